@@ -0,0 +1,59 @@
+import numpy as np
+
+# Pan/zoom camera mapping world coordinates to the window.
+#
+# The world can be much larger than the window; everything the viewer draws
+# goes through world_to_screen(), and visible() is used to cull vehicles,
+# trail points and lights that do not intersect the viewport before any
+# pygame drawing call is made.
+
+MIN_ZOOM = 0.01
+MAX_ZOOM = 8.0
+
+
+class Camera:
+    def __init__(self, view_width, view_height, world_width, world_height, zoom=None):
+        self.view_width = view_width
+        self.view_height = view_height
+        self.world_width = world_width
+        self.world_height = world_height
+
+        # world point shown in the middle of the window
+        self.center = np.array([world_width / 2, world_height / 2])
+        if zoom is None:
+            zoom = min(1.0, view_width / world_width, view_height / world_height)
+        self.zoom = zoom
+
+    def world_to_screen(self, points):
+        points = np.asarray(points, dtype=float)
+        return (points - self.center) * self.zoom + (self.view_width / 2, self.view_height / 2)
+
+    def screen_to_world(self, points):
+        points = np.asarray(points, dtype=float)
+        return (points - (self.view_width / 2, self.view_height / 2)) / self.zoom + self.center
+
+    def visible_rect(self):
+        # (left, top, right, bottom) of the viewport in world coordinates
+        half = np.array([self.view_width, self.view_height]) / (2 * self.zoom)
+        left, top = self.center - half
+        right, bottom = self.center + half
+        return left, top, right, bottom
+
+    def visible(self, points, margin=0):
+        # mask of the points whose circle of radius `margin` touches the viewport
+        left, top, right, bottom = self.visible_rect()
+        points = np.asarray(points)
+        x, y = points[..., 0], points[..., 1]
+        return (x + margin >= left) & (x - margin <= right) & (y + margin >= top) & (y - margin <= bottom)
+
+    def pan(self, dx, dy):
+        # move by a screen-space offset
+        self.center += np.array([dx, dy]) / self.zoom
+        self.center[0] = np.clip(self.center[0], 0, self.world_width)
+        self.center[1] = np.clip(self.center[1], 0, self.world_height)
+
+    def zoom_at(self, factor, screen_point):
+        # zoom keeping the world point under the cursor fixed
+        anchor = self.screen_to_world(screen_point)
+        self.zoom = float(np.clip(self.zoom * factor, MIN_ZOOM, MAX_ZOOM))
+        self.center += anchor - self.screen_to_world(screen_point)
@@ -0,0 +1,97 @@
+import sys
+
+import numpy as np
+
+# Counter-based noise for simulation.py (Philox4x32, Salmon et al. 2011).
+#
+# A counter-based generator has no state to advance: the random words for
+# (world, vehicle, tick, slot) are a keyed hash of that tuple. Every
+# vehicle's noise is then fixed by the seed and its own indices alone - it
+# does not depend on how many vehicles or worlds share the run, in what
+# order they are stepped or how the ticks are batched - and a whole tick of
+# an ensemble is drawn with a few array operations.
+#
+# The counter is (tick, vehicle, world, block) and one hash gives four
+# 32-bit words: four float32 or two float64 uniforms per block. Ticks wrap
+# at 2**32.
+#
+#   sim = Simulation(1000, 8, "vehicle5", seed=3, counter_noise=True)
+
+PHILOX_M = (0xD2511F53, 0xCD9E8D57)
+PHILOX_W = (0x9E3779B9, 0xBB67AE85)
+ROUNDS = 10
+MASK = 0xFFFFFFFF
+
+
+def philox(counter, key, rounds=ROUNDS):
+    # Philox4x32: counter (4, ...) of 32-bit words (broadcastable), key (2,)
+    # -> (4, ...) uint32. The 32x32 products go to uint64 buffers whose two
+    # halves are read back as uint32 views, everything else is in place.
+    shape = np.broadcast_shapes(*(np.shape(c) for c in counter))
+    c0, c1, c2, c3 = (np.array(np.broadcast_to(c, shape), dtype=np.uint32) for c in counter)
+    h0, h1 = np.empty((*shape, 2), dtype=np.uint32), np.empty((*shape, 2), dtype=np.uint32)
+    p0, p1 = h0.view(np.uint64)[..., 0], h1.view(np.uint64)[..., 0]
+    low, high = (0, 1) if sys.byteorder == "little" else (1, 0)
+    m0, m1 = np.uint64(PHILOX_M[0]), np.uint64(PHILOX_M[1])
+    k0, k1 = int(key[0]), int(key[1])
+    for _ in range(rounds):
+        np.multiply(c0, m0, out=p0)
+        np.multiply(c2, m1, out=p1)
+        # (c0, c1, c2, c3) <- (hi1 ^ c1 ^ k0, lo1, hi0 ^ c3 ^ k1, lo0)
+        c1 ^= h1[..., high]
+        c1 ^= np.uint32(k0)
+        c3 ^= h0[..., high]
+        c3 ^= np.uint32(k1)
+        c0[...] = h1[..., low]
+        c2[...] = h0[..., low]
+        c0, c1, c2, c3 = c1, c0, c3, c2
+        k0 = (k0 + PHILOX_W[0]) & MASK
+        k1 = (k1 + PHILOX_W[1]) & MASK
+    return np.stack((c0, c1, c2, c3))
+
+
+def seed_key(seed):
+    # the (2,) uint32 key of a seed (an int, a sequence of ints or None)
+    return np.random.SeedSequence(seed).generate_state(2, np.uint32)
+
+
+def uniforms(key, world, vehicle, tick, slots, dtype=np.float64, rounds=ROUNDS):
+    # (slots, ...) uniforms in [0, 1) for world/vehicle index arrays (they
+    # broadcast) at one tick
+    dtype = np.dtype(dtype)
+    per_block = 4 if dtype == np.float32 else 2
+    blocks = -(-slots // per_block)
+    world, vehicle = np.broadcast_arrays(np.asarray(world, dtype=np.uint64), np.asarray(vehicle, dtype=np.uint64))
+    block = np.arange(blocks, dtype=np.uint64).reshape(-1, *([1] * world.ndim))
+    words = philox((np.uint64(tick & MASK), vehicle, world, block), key, rounds)
+
+    # (4, blocks, ...) words -> (blocks * per_block, ...) uniforms
+    if dtype == np.float32:
+        values = (words >> 8).astype(np.float32) * np.float32(2 ** -24)
+    else:
+        high, low = (words[0::2] >> 5).astype(np.float64), (words[1::2] >> 6).astype(np.float64)
+        values = (high * 2 ** 26 + low) * 2 ** -53
+    values = np.moveaxis(values, 0, 1).reshape(-1, *world.shape)
+    return values[:slots]
+
+
+class CounterNoise:
+    # Drop-in for simulation.WorldNoise: next() returns the (slots, worlds,
+    # vehicles) uniforms of the next tick.
+    def __init__(self, seed, num_worlds, num_vehicles, slots, dtype=np.float64, rounds=ROUNDS):
+        self.key = seed_key(seed)
+        self.world = np.arange(num_worlds)[:, None]
+        self.vehicle = np.arange(num_vehicles)[None, :]
+        self.slots = slots
+        self.dtype = dtype
+        self.rounds = rounds
+        self.tick = 0
+
+    @property
+    def nbytes(self):
+        return 0
+
+    def next(self):
+        sample = uniforms(self.key, self.world, self.vehicle, self.tick, self.slots, self.dtype, self.rounds)
+        self.tick += 1
+        return sample
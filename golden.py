@@ -0,0 +1,303 @@
+import argparse
+import ast
+import functools
+import math
+import os
+
+import numpy as np
+
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy")
+import pygame
+
+from light_index import LightIndex
+from simulation import BROWNIAN_INTERVAL, MODELS, Simulation
+
+# Golden-trajectory equivalence harness.
+#
+# The reference is the scalar code in the original scripts: their classes and
+# functions are loaded (without the main loop or the window) and stepped with
+# the loop body of the script. Both the scripts and the engine under test
+# draw their randomness from the same table of uniforms u[tick, slot,
+# vehicle], so any difference between the trajectories is a difference in
+# the dynamics, not in the random numbers.
+#
+#   python golden.py                         # all scenarios against Simulation
+#   python golden.py --ticks 5000 --save golden/
+
+SCENARIOS = {
+    "vehicle1": dict(script="vehicle1_final.py", model="vehicle1", vehicles=4, toggles={}),
+    "vehicle2": dict(script="vehicle2.py", model="vehicle2", vehicles=1, toggles={}),
+    "vehicle3": dict(script="vehicle3.py", model="vehicle3", vehicles=1,
+                     toggles=dict(inhibition=True, cross=True, friction=True)),
+    "vehicle3_final": dict(script="vehicle3_final.py", model="vehicle3", vehicles=1, toggles=dict(friction=True)),
+    "vehicle4": dict(script="vehicle4_final.py", model="vehicle4", vehicles=1, toggles=dict(friction=True)),
+    "vehicle4_cross": dict(script="vehicle4_final.py", model="vehicle4", vehicles=1,
+                           toggles=dict(friction=True, cross=True, inhibition=True)),
+    "vehicle5": dict(script="vehicle5.py", model="vehicle5", vehicles=1, toggles={}),
+}
+
+TICKS = 1000
+POSITION_TOLERANCE = 1e-3  # px
+DIRECTION_TOLERANCE = 1e-3  # degrees
+
+
+def load_script(path):
+    # imports, functions, classes and constant assignments of a script, but
+    # none of its top-level calls (window, main loop)
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    keep = []
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom, ast.FunctionDef, ast.ClassDef)):
+            keep.append(node)
+        elif isinstance(node, ast.Assign) and not isinstance(node.value, ast.Call):
+            keep.append(node)
+
+    namespace = {"__name__": os.path.splitext(os.path.basename(path))[0]}
+    exec(compile(ast.Module(keep, type_ignores=[]), path, "exec"), namespace)
+
+    pygame.init()
+    namespace["screen"] = pygame.Surface((namespace.get("WIDTH", 800), namespace.get("HEIGHT", 800)))
+    namespace["font"] = pygame.font.Font(None, 20)
+    return namespace
+
+
+class SlotRandom:
+    # Stands in for the `random` module inside a script. Each call is mapped
+    # to the noise slot the engine uses for the same purpose.
+    def __init__(self, uniforms, model):
+        self.uniforms = uniforms
+        self.model = model
+        self.tick = 0
+        self.vehicle = 0
+        self.calls = 0
+
+    def begin(self, tick, vehicle):
+        self.tick = tick
+        self.vehicle = vehicle
+        self.calls = 0
+
+    def sample(self, slot):
+        return float(self.uniforms[self.tick, slot, self.vehicle])
+
+    def slot(self, name, args):
+        if self.model != "vehicle5":
+            return 0
+        # vehicle5.py: uniform(-E, E), random(), uniform(0.5, 1.5), random(), uniform(-2, 2)
+        if name == "uniform":
+            return {(0.5, 1.5): 2, (-2, 2): 4}.get(args, 0)
+        self.calls += 1
+        return 1 if self.calls == 1 else 3
+
+    def uniform(self, a, b):
+        return a + (b - a) * self.sample(self.slot("uniform", (a, b)))
+
+    def random(self):
+        return self.sample(self.slot("random", ()))
+
+    def randint(self, a, b):
+        return a + int(math.floor(self.sample(self.slot("randint", (a, b))) * (b - a + 1)))
+
+
+class ReplayNoise:
+    # engine-side view of the same uniforms, in WorldNoise.next() layout
+    def __init__(self, uniforms):
+        self.uniforms = uniforms
+        self.tick = 0
+
+    def next(self):
+        sample = self.uniforms[self.tick][:, None, :]
+        self.tick += 1
+        return sample
+
+
+def initial_state(scenario, seed):
+    params = MODELS[scenario["model"]]
+    rng = np.random.default_rng(seed)
+    n = scenario["vehicles"]
+    if params["start"] is not None and n == 1:
+        position, direction = params["start"]
+        position, direction = np.array([position], dtype=float), np.array([direction], dtype=float)
+    elif n == 1:
+        position = np.array([[params["width"] // 2, params["height"] // 2]], dtype=float)
+        direction = rng.integers(0, 361, n).astype(float)
+    else:
+        position = rng.integers(0, (params["width"], params["height"]), (n, 2)).astype(float)
+        direction = rng.integers(0, 361, n).astype(float)
+    intensity = rng.uniform(0.7, 1.0, len(params["lights"])) if scenario["model"] == "vehicle5" else None
+    uniforms = rng.random((scenario["ticks"], params["noise_slots"], n))
+    return dict(position=position, direction=direction, intensity=intensity, uniforms=uniforms)
+
+
+def run_script(scenario, state):
+    namespace = load_script(scenario["script"])
+    params = MODELS[scenario["model"]]
+    ticks = scenario["ticks"]
+    rand = SlotRandom(state["uniforms"], scenario["model"])
+    namespace["random"] = rand
+    for toggle, value in scenario["toggles"].items():
+        if toggle.upper() in namespace:
+            namespace[toggle.upper()] = value
+
+    Vector2 = pygame.math.Vector2
+    vehicles = []
+    for position, direction in zip(state["position"], state["direction"]):
+        vehicles.append(namespace["Vehicle"](tuple(position), float(direction)))
+
+    if scenario["model"] == "vehicle5":
+        lights = [
+            namespace["LightSource"](position, intensity=intensity)
+            for position, intensity in zip(params["lights"], state["intensity"])
+        ]
+        for vehicle in vehicles:
+            vehicle.update_sensor_positions()
+    else:
+        sun = Vector2(params["lights"][0])
+
+    n = len(vehicles)
+    trajectory = np.zeros((ticks, n, 3))
+    visits = np.zeros((ticks, len(params["lights"])), dtype=np.int64)
+    for tick in range(ticks):
+        if scenario["model"] == "vehicle1":
+            # loop body of vehicle1_final.py, Brownian turns on the engine's tick schedule
+            if tick % BROWNIAN_INTERVAL == BROWNIAN_INTERVAL - 1:
+                for i, vehicle in enumerate(vehicles):
+                    rand.begin(tick, i)
+                    vehicle.update_direction()
+            for i in range(n):
+                for j in range(i + 1, n):
+                    if namespace["check_collision"](vehicles[i], vehicles[j]):
+                        collision_vector = vehicles[j].position - vehicles[i].position
+                        collision_vector.normalize_ip()
+                        up = Vector2(0, -1)
+                        direction1 = Vector2(0, -1).rotate(vehicles[i].direction)
+                        direction2 = Vector2(0, -1).rotate(vehicles[j].direction)
+                        reflected1 = direction1 - 2 * (direction1.dot(collision_vector) * collision_vector)
+                        reflected2 = direction2 - 2 * (direction2.dot(-collision_vector) * -collision_vector)
+                        vehicles[i].direction = reflected1.angle_to(up)
+                        vehicles[j].direction = reflected2.angle_to(up)
+            for i, vehicle in enumerate(vehicles):
+                rand.begin(tick, i)
+                vehicle.move(sun)
+        elif scenario["model"] == "vehicle5":
+            for i, vehicle in enumerate(vehicles):
+                rand.begin(tick, i)
+                vehicle.move(lights)
+            visits[tick] = [light.visited_count for light in lights]
+        else:
+            for i, vehicle in enumerate(vehicles):
+                rand.begin(tick, i)
+                vehicle.move(sun)
+
+        for i, vehicle in enumerate(vehicles):
+            trajectory[tick, i] = (vehicle.position.x, vehicle.position.y, vehicle.direction)
+    return trajectory, visits
+
+
+def run_simulation(scenario, state, **options):
+    sim = Simulation(scenario["vehicles"], 1, scenario["model"], seed=0, **options)
+    for toggle, value in scenario["toggles"].items():
+        getattr(sim, toggle)[:] = value
+
+    sim.position[0] = state["position"]
+    sim.direction[0] = state["direction"]
+    if state["intensity"] is not None:
+        sim.light_intensity[0] = state["intensity"]
+    sim.reset_sensor_positions()
+    sim.noise = ReplayNoise(state["uniforms"])
+
+    trajectory = np.zeros((scenario["ticks"], sim.num_vehicles, 3))
+    visits = np.zeros((scenario["ticks"], sim.num_lights), dtype=np.int64)
+    for tick in range(scenario["ticks"]):
+        sim.step()
+        trajectory[tick, :, :2] = sim.position[0]
+        trajectory[tick, :, 2] = sim.direction[0]
+        visits[tick] = sim.visited_count[0]
+    return trajectory, visits
+
+
+# engines under test: callables (scenario, initial state) -> (trajectory, visits)
+ENGINES = {
+    "simulation": run_simulation,
+    "compact": functools.partial(run_simulation, compact=True),
+    "heading_table": functools.partial(run_simulation, heading_table=True),
+    "light_index": functools.partial(run_simulation, light_index=LightIndex()),
+}
+
+# (position px, direction deg) for engines that are not expected to match to
+# double precision; float32 rounding grows to a fraction of a pixel in 1000 ticks,
+# and so do the up to 1/1440 degree heading errors of the sine table
+ENGINE_TOLERANCES = {
+    "compact": (1.0, 1.0),
+    "heading_table": (1.0, 1.0),
+}
+
+
+def compare(scenario, golden, candidate,
+            position_tolerance=POSITION_TOLERANCE, direction_tolerance=DIRECTION_TOLERANCE):
+    params = MODELS[scenario["model"]]
+    golden_trajectory, golden_visits = golden
+    trajectory, visits = candidate
+
+    # positions wrap, so compare them on the torus
+    size = np.array([params["width"], params["height"]])
+    delta = trajectory[..., :2] - golden_trajectory[..., :2]
+    delta = (delta + size / 2) % size - size / 2
+    position_error = np.linalg.norm(delta, axis=-1).max(axis=-1)
+    direction_error = np.abs((trajectory[..., 2] - golden_trajectory[..., 2] + 180) % 360 - 180).max(axis=-1)
+    visit_error = np.abs(visits - golden_visits).max(axis=-1)
+
+    diverged = (position_error > position_tolerance) | (direction_error > direction_tolerance) | (visit_error > 0)
+    first = int(np.argmax(diverged)) if diverged.any() else None
+    return {
+        "passed": first is None,
+        "ticks": len(position_error),
+        "divergence_tick": first,
+        "divergence_position_error": None if first is None else float(position_error[first]),
+        "divergence_direction_error": None if first is None else float(direction_error[first]),
+        "max_position_error": float(position_error.max()),
+        "max_direction_error": float(direction_error.max()),
+        "visit_mismatches": int(np.count_nonzero(visit_error)),
+    }
+
+
+def check(name, engine="simulation", ticks=TICKS, seed=0, save=None):
+    scenario = dict(SCENARIOS[name], ticks=ticks)
+    state = initial_state(scenario, seed)
+    golden = run_script(scenario, state)
+    if save:
+        os.makedirs(save, exist_ok=True)
+        np.savez_compressed(
+            os.path.join(save, f"{name}_seed{seed}.npz"), trajectory=golden[0], visits=golden[1], **{
+                key: value for key, value in state.items() if value is not None
+            }
+        )
+    tolerances = ENGINE_TOLERANCES.get(engine, (POSITION_TOLERANCE, DIRECTION_TOLERANCE))
+    return compare(scenario, golden, ENGINES[engine](scenario, state), *tolerances)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare an engine against the scalar scripts.")
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS), help="default: all")
+    parser.add_argument("--engine", default="simulation", choices=list(ENGINES))
+    parser.add_argument("--ticks", type=int, default=TICKS)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--save", help="directory to write the golden trajectories to")
+    args = parser.parse_args()
+
+    failed = False
+    for name in args.scenarios:
+        report = check(name, args.engine, args.ticks, args.seed, args.save)
+        failed |= not report["passed"]
+        if report["passed"]:
+            print(f"{name:16s} ok       max error {report['max_position_error']:.2e} px "
+                  f"{report['max_direction_error']:.2e} deg over {report['ticks']} ticks")
+        else:
+            print(f"{name:16s} DIVERGED at tick {report['divergence_tick']}: "
+                  f"{report['divergence_position_error']:.3g} px, {report['divergence_direction_error']:.3g} deg "
+                  f"(max {report['max_position_error']:.3g} px, {report['visit_mismatches']} visit mismatches)")
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
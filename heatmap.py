@@ -0,0 +1,47 @@
+import numpy as np
+
+# Occupancy grid: how many ticks vehicles have spent in every cell of a
+# coarse grid over the arena. It is a simulation stage, updated after every
+# step with one scatter-add of the vehicle cells; renderer.HeatmapOverlay
+# draws it.
+#
+# `counts` is indexed [x, y] (like pygame.surfarray) and can live in a
+# caller-provided buffer, e.g. shared memory so a viewer in another process
+# can read it (see shared_state.SimulationProcess).
+
+HEATMAP_CELL = 10
+
+
+def grid_shape(width, height, cell=HEATMAP_CELL):
+    return int(np.ceil(width / cell)), int(np.ceil(height / cell))
+
+
+class OccupancyGrid:
+    def __init__(self, width, height, cell=HEATMAP_CELL, world=0, counts=None):
+        self.cell = cell
+        self.world = world
+        self.shape = grid_shape(width, height, cell)
+        if counts is None:
+            counts = np.zeros(self.shape, dtype=np.uint32)
+        self.counts = counts
+
+    def reset(self, sim):
+        self.counts[:] = 0
+        self.time = 0.0
+
+    def update(self, sim):
+        # with an adaptive step size a step covers sim.step_dt ticks: the
+        # vehicles are counted once for every whole tick the clock passes
+        time = self.time + sim.step_dt[self.world]
+        ticks = int(np.floor(time + 1e-9) - np.floor(self.time + 1e-9))
+        self.time = time
+        if not ticks:
+            return
+        cells = (sim.position[self.world] // self.cell).astype(np.int64)
+        x = np.clip(cells[:, 0], 0, self.shape[0] - 1)
+        y = np.clip(cells[:, 1], 0, self.shape[1] - 1)
+        np.add.at(self.counts, (x, y), ticks)
+
+    def coverage(self):
+        # fraction of cells visited at least once
+        return np.count_nonzero(self.counts) / self.counts.size
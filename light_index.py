@@ -0,0 +1,119 @@
+import numpy as np
+
+# Spatial index of the lights for the visit detection of simulation.py.
+#
+# vehicle5 counts a visit when a vehicle comes within visit_threshold of its
+# closest light, and forgets its last visit once it is more than
+# visit_threshold * 2 from every light, so nothing further away than that
+# ever matters. The lights are binned in a grid of cells at least that
+# wide (CSR layout, one grid per world), and a vehicle only measures the
+# lights of its own and the eight surrounding cells instead of all of them.
+# The grid is rebuilt only when a light moves into another cell.
+#
+#   sim = Simulation(10000, 1, "vehicle5", lights=many, light_index=LightIndex())
+#
+# Visits are also handed, one batch per tick, to the callables registered
+# with sim.subscribe_visits(); VisitLog keeps them for whoever reads them
+# later (statistics, a renderer flashing the visited lights).
+
+NEIGHBOURS = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+
+
+class LightIndex:
+    def __init__(self, cell=None):
+        self.cell = cell  # None: visit_threshold * 2
+
+    def reset(self, sim):
+        self.reach = 2 * sim.visit_threshold
+        cell = self.cell or self.reach
+        if cell < self.reach:
+            raise ValueError(f"light index cells of {cell} px are smaller than the visit reach {self.reach}")
+        # a whole number of cells across the arena, so the grid wraps with it
+        arena = np.array([sim.width, sim.height])
+        self.shape = np.maximum(1, arena // cell).astype(np.int64)
+        self.size = arena / self.shape
+        self.light_cells = None
+        self.build(sim)
+
+    def cells(self, points):
+        return np.floor(points / self.size).astype(np.int64) % self.shape
+
+    def build(self, sim):
+        # the lights of cell k of world w are items[offsets[j]:offsets[j + 1]],
+        # j = (w * shape[0] + x) * shape[1] + y
+        w, l = sim.num_worlds, sim.num_lights
+        cells = self.cells(sim.light_position)
+        world = np.repeat(np.arange(w), l)
+        keys = (world * self.shape[0] + cells[..., 0].reshape(-1)) * self.shape[1] + cells[..., 1].reshape(-1)
+        order = np.argsort(keys, kind="stable")
+        self.items = order % l
+        self.offsets = np.searchsorted(keys[order], np.arange(w * self.shape[0] * self.shape[1] + 1))
+        self.light_cells = cells
+
+    def update(self, sim):
+        cells = self.cells(sim.light_position)
+        if not np.array_equal(cells, self.light_cells):
+            self.build(sim)
+
+    def nearest(self, sim, points):
+        # (worlds, vehicles) closest light within reach and its distance, or
+        # -1 and inf; ties go to the lowest light index, as with np.argmin
+        self.update(sim)
+        w, n = points.shape[:2]
+        cells = self.cells(points)[:, :, None, :] + NEIGHBOURS
+        cells %= self.shape
+        world = np.arange(w)[:, None, None]
+        keys = ((world * self.shape[0] + cells[..., 0]) * self.shape[1] + cells[..., 1]).reshape(-1)
+
+        low = self.offsets[keys]
+        counts = self.offsets[keys + 1] - low
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        point = np.repeat(np.arange(w * n).repeat(len(NEIGHBOURS)), counts)
+        light = self.items[np.repeat(low, counts) + local]
+
+        delta = points.reshape(-1, 2)[point] - sim.light_position[point // n, light]
+        if sim.periodic:
+            sim.minimum_image(delta)
+        distance = np.sqrt((delta * delta).sum(axis=-1))
+
+        # the pairs come grouped by point: segment minima, no sorting
+        closest = np.full(w * n, -1, dtype=np.int64)
+        min_distance = np.full(w * n, np.inf, dtype=distance.dtype)
+        if not len(point):
+            return closest.reshape(w, n), min_distance.reshape(w, n)
+        start = np.flatnonzero(np.diff(point, prepend=-1))
+        points_with = point[start]
+        nearest = np.minimum.reduceat(distance, start)
+        tied = distance == np.repeat(nearest, np.diff(start, append=len(point)))
+        lowest = np.minimum.reduceat(np.where(tied, light, np.iinfo(np.int64).max), start)
+        near = nearest <= self.reach
+        closest[points_with[near]] = lowest[near]
+        min_distance[points_with[near]] = nearest[near]
+        return closest.reshape(w, n), min_distance.reshape(w, n)
+
+
+class VisitLog:
+    # A visit subscriber (sim.subscribe_visits(VisitLog())) that keeps the
+    # events until drain(), at most `capacity` of them (oldest dropped).
+    def __init__(self, capacity=1_000_000):
+        self.capacity = capacity
+        self.chunks = []
+        self.count = 0
+
+    def __call__(self, sim, worlds, vehicles, lights):
+        # visits are published while the step is still running: stamp them
+        # with the tick that step ends on, as OnlineStatistics.first_visit
+        self.chunks.append((np.full(len(worlds), sim.tick + 1), worlds, vehicles, lights))
+        self.count += len(worlds)
+        while self.count > self.capacity and len(self.chunks) > 1:
+            self.count -= len(self.chunks.pop(0)[0])
+
+    def drain(self):
+        # {"tick", "world", "vehicle", "light"} arrays, oldest first
+        names = ("tick", "world", "vehicle", "light")
+        if not self.chunks:
+            return {name: np.zeros(0, dtype=np.int64) for name in names}
+        events = {name: np.concatenate(column) for name, column in zip(names, zip(*self.chunks))}
+        self.chunks = []
+        self.count = 0
+        return events
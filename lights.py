@@ -0,0 +1,90 @@
+import numpy as np
+
+# Moving and pulsing lights: a simulation stage that changes the lights of
+# simulation.py in place after every step.
+#
+#   drift         random walk of `drift` px per tick, for a random
+#                 `moving` fraction of the lights each tick
+#   orbit_radius  scripted motion: every light circles its start position
+#                 once per `orbit_period` ticks (random phase)
+#   path          scripted motion: path(time, start) -> (worlds, lights, 2),
+#                 time the (worlds, 1) simulated ticks of each world
+#   pulse_depth   intensity oscillates between (1 - depth) and 1 times the
+#                 start intensity once per `pulse_period` ticks
+#   flicker       Gaussian intensity noise, clipped to [0, 1]
+#
+# Time is simulated ticks, kept per world: with the adaptive integrator a
+# step covers sim.step_dt of them, so orbits, paths and pulses follow the
+# simulated clock rather than the step count.
+#
+# Only the lights that moved change position, and caches keyed on light
+# positions (occlusion.Occlusion's visibility tables) are refreshed for
+# those lights only. In an Ecology the lights are shared: add the stage to
+# one group.
+
+PULSE_PERIOD = 240  # ticks, 2 s at 120 fps
+ORBIT_PERIOD = 1200
+
+
+class LightMotion:
+    def __init__(self, drift=0.0, moving=1.0, orbit_radius=0.0, orbit_period=ORBIT_PERIOD, path=None,
+                 pulse_depth=0.0, pulse_period=PULSE_PERIOD, flicker=0.0, seed=None):
+        self.drift = drift
+        self.moving = moving
+        self.orbit_radius = orbit_radius
+        self.orbit_period = orbit_period
+        self.path = path
+        self.pulse_depth = pulse_depth
+        self.pulse_period = pulse_period
+        self.flicker = flicker
+        self.seed = seed
+
+    def reset(self, sim):
+        self.rng = np.random.default_rng(self.seed)
+        self.start = sim.light_position.copy()
+        self.base_intensity = sim.light_intensity.copy()
+        self.phase = self.rng.uniform(0, 2 * np.pi, (sim.num_worlds, sim.num_lights, 2))
+        self.offset = np.zeros_like(self.start, dtype=float)
+        self.time = np.zeros(sim.num_worlds)
+        # (worlds, lights): which lights moved in the last update
+        self.moved = np.zeros((sim.num_worlds, sim.num_lights), dtype=bool)
+
+    def update(self, sim):
+        # simulated ticks per world: with an adaptive step size a step covers
+        # sim.step_dt of them, and the random walk scales with its root
+        self.time += sim.step_dt
+        tick = self.time[:, None]
+        self.moved[:] = False
+
+        if self.drift:
+            walking = self.rng.random(self.moved.shape) < self.moving
+            steps = self.rng.normal(0, self.drift, (int(walking.sum()), 2))
+            scale = np.broadcast_to(np.sqrt(sim.step_dt)[:, None], walking.shape)[walking]
+            self.offset[walking] += steps * scale[:, None]
+            self.moved |= walking & (sim.step_dt[:, None] > 0)
+
+        position = self.start + self.offset
+        if self.orbit_radius:
+            angle = 2 * np.pi * tick / self.orbit_period + self.phase[..., 0]
+            position = position + self.orbit_radius * np.stack((np.cos(angle), np.sin(angle)), axis=-1)
+            self.moved[:] = True
+        if self.path is not None:
+            position = np.asarray(self.path(tick, self.start), dtype=float)
+            self.moved |= (position != sim.light_position).any(axis=-1)
+
+        if self.moved.any():
+            worlds, lights = np.nonzero(self.moved)
+            moved = position[worlds, lights]
+            moved[:, 0] %= sim.width
+            moved[:, 1] %= sim.height
+            sim.light_position[worlds, lights] = moved
+
+        if self.pulse_depth or self.flicker:
+            level = 1.0
+            if self.pulse_depth:
+                wave = 0.5 + 0.5 * np.sin(2 * np.pi * tick / self.pulse_period + self.phase[..., 1])
+                level = 1 - self.pulse_depth * wave
+            intensity = self.base_intensity * level
+            if self.flicker:
+                intensity = intensity + self.rng.normal(0, self.flicker, intensity.shape)
+            sim.light_intensity[:] = np.clip(intensity, 0, 1)
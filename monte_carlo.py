@@ -0,0 +1,258 @@
+import argparse
+import functools
+import json
+import statistics
+import sys
+import time
+import warnings
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from online_stats import Welford
+from simulation import Simulation
+
+# Monte Carlo estimates that stop when they are precise enough.
+#
+# A replicate is a function seed -> sample(s) of a metric (a number or an
+# array, e.g. one value per world of a batched Simulation). Replicates run
+# in parallel worker processes; their results are folded into a running
+# mean and confidence interval in seed order, so the estimate and the point
+# where it stops do not depend on which worker finished first. No new
+# replicates are scheduled once the interval half-width is below the
+# requested precision (absolute, or relative to the mean).
+#
+# NaN marks a censored sample, e.g. a time that ran past the replicate's
+# cap. With `cap` set censored samples count as the cap, so the estimate is
+# the restricted mean E[min(T, cap)] and never leaves them out. Either way
+# the estimate is only reported as converged while at most `max_censored`
+# of the samples are censored. Once at least 10 / max_censored samples show
+# a censored fraction significantly above that (one-sided Wilson bound at the
+# confidence level) the run stops with a warning, since more replicates will
+# not make the metric defined.
+#
+#   python monte_carlo.py --precision 50 --workers 4
+#   python monte_carlo.py --precision 0.05 --relative --max-ticks 50000
+#
+# The summary reports the runs used, the CPU time they took, and the CPU
+# time saved against running all --max-runs replicates.
+
+CONFIDENCE = 0.95
+MIN_SAMPLES = 30  # before the interval is trusted
+MAX_RUNS = 1000
+MAX_CENSORED = 0.01  # fraction of censored samples an estimate may have
+MAX_TICKS = 20000
+
+
+def timed(replicate, seed):
+    # samples of one replicate and the CPU time they took in the worker
+    start = time.process_time()
+    values = np.atleast_1d(np.asarray(replicate(seed), dtype=float)).reshape(-1)
+    return values, time.process_time() - start
+
+
+def ticks_to_sun(seed, worlds=64, inhibition=False, max_ticks=MAX_TICKS):
+    # ticks until a vehicle4 vehicle, from a random start in each world, has
+    # its centre on the sun (NaN when it does not within max_ticks). With
+    # inhibition most vehicles settle beside the sun and never get there.
+    sim = Simulation(1, worlds, "vehicle4", seed=seed)
+    sim.inhibition[:] = inhibition
+    rng = np.random.default_rng(seed)
+    sim.position[:, 0] = rng.uniform((0, 0), (sim.width, sim.height), (worlds, 2))
+    sim.direction[:, 0] = rng.uniform(0, 360, worlds)
+    sim.reset_sensor_positions()
+
+    sun = sim.light_position[:, 0]
+    reached = np.full(worlds, np.nan)
+    for tick in range(1, max_ticks + 1):
+        sim.step()
+        on_sun = np.linalg.norm(sim.position[:, 0] - sun, axis=-1) < sim.light_radius
+        reached[on_sun & np.isnan(reached)] = tick
+        if not np.isnan(reached).any():
+            break
+    return reached
+
+
+class MonteCarlo:
+    def __init__(self, replicate, precision, relative=False, confidence=CONFIDENCE, min_samples=MIN_SAMPLES,
+                 max_runs=MAX_RUNS, workers=1, seed=0, cap=None, max_censored=MAX_CENSORED):
+        self.replicate = replicate
+        self.cap = cap
+        self.max_censored = max_censored
+        self.precision = precision
+        self.relative = relative
+        self.confidence = confidence
+        self.z = statistics.NormalDist().inv_cdf(0.5 + confidence / 2)
+        self.z_one_sided = statistics.NormalDist().inv_cdf(confidence)
+        self.min_samples = min_samples
+        self.max_runs = max_runs
+        self.workers = workers
+        self.seed = seed
+
+    def reset(self):
+        self.stats = Welford(())
+        self.censored = 0
+        self.runs = 0
+        self.cpu_time = 0.0
+
+    def fold(self, values, cpu_time):
+        censored = np.isnan(values)
+        if self.cap is not None:
+            values = np.where(censored, self.cap, values)
+        else:
+            values = values[~censored]
+        for value in values:
+            self.stats.update(value)
+        self.censored += int(censored.sum())
+        self.runs += 1
+        self.cpu_time += cpu_time
+
+    def half_width(self):
+        if self.stats.count < 2:
+            return np.inf
+        return self.z * float(np.sqrt(self.stats.variance() / self.stats.count))
+
+    def samples(self):
+        # all samples folded in, censored or not
+        return self.stats.count + (0 if self.cap is not None else self.censored)
+
+    def censored_fraction(self):
+        return self.censored / max(1, self.samples())
+
+    def censored_lower_bound(self):
+        # one-sided Wilson score lower bound of the censored fraction
+        n = self.samples()
+        if n == 0:
+            return 0.0
+        p, z = self.censored_fraction(), self.z_one_sided
+        centre = p + z * z / (2 * n)
+        spread = z * np.sqrt(p * (1 - p) / n + z * z / (4 * n * n))
+        return max(0.0, (centre - spread) / (1 + z * z / n))
+
+    def undefined(self):
+        # significantly too many censored samples for the estimate to mean
+        # anything, judged on enough samples to resolve max_censored; until
+        # then replicates keep being scheduled
+        enough = max(self.min_samples, np.ceil(10 / self.max_censored))
+        return self.samples() >= enough and self.censored_lower_bound() > self.max_censored
+
+    def converged(self):
+        if self.stats.count < self.min_samples or self.undefined():
+            return False
+        target = self.precision * abs(float(self.stats.mean)) if self.relative else self.precision
+        return self.half_width() <= target
+
+    def run(self):
+        self.reset()
+        start = time.perf_counter()
+        seeds = ([self.seed, index] for index in range(self.max_runs))
+        started = 0
+        discarded_cpu = 0.0
+
+        if self.workers == 1:
+            for seed in seeds:
+                started += 1
+                self.fold(*timed(self.replicate, seed))
+                if self.converged() or self.undefined():
+                    break
+        else:
+            # results that arrive out of order wait here until their turn
+            finished = {}
+            with ProcessPoolExecutor(self.workers) as pool:
+                pending = {}
+                stop = False
+                while True:
+                    while not stop and len(pending) < self.workers and started < self.max_runs:
+                        pending[pool.submit(timed, self.replicate, next(seeds))] = started
+                        started += 1
+                    if not pending:
+                        break
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        finished[pending.pop(future)] = future.result()
+                    while not stop and self.runs in finished:
+                        self.fold(*finished.pop(self.runs))
+                        stop = self.converged() or self.undefined()
+                    if stop:
+                        for future in pending:
+                            future.cancel()
+                        # replicates already running are finished but not used
+                        for future in [f for f in pending if not f.cancelled()]:
+                            discarded_cpu += future.result()[1]
+                        started -= sum(f.cancelled() for f in pending)
+                        pending = {}
+                discarded_cpu += sum(cpu for _, cpu in finished.values())
+
+        converged = self.converged()
+        if self.censored_fraction() > self.max_censored:
+            warnings.warn(
+                f"{self.censored} of {self.samples()} samples are censored (more than {self.max_censored:.0%}); "
+                "the estimate is not converged, raise the cap or change the scenario"
+            )
+        # only a converged run saved anything
+        runs_saved = self.max_runs - started if converged else 0
+        cpu_per_run = self.cpu_time / max(1, self.runs)
+        half_width = self.half_width()
+        mean = float(self.stats.mean)
+        return {
+            "mean": mean,
+            "std": float(np.sqrt(self.stats.variance())),
+            "half_width": half_width,
+            "interval": [mean - half_width, mean + half_width],
+            "confidence": self.confidence,
+            "converged": converged,
+            "runs": self.runs,
+            "samples": self.samples(),
+            "censored": self.censored,
+            "censored_fraction": self.censored_fraction(),
+            "cap": self.cap,
+            "runs_discarded": started - self.runs,
+            "cpu_time": self.cpu_time + discarded_cpu,
+            "wall_time": time.perf_counter() - start,
+            "runs_saved": runs_saved,
+            "cpu_time_saved": runs_saved * cpu_per_run,
+        }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Estimate the mean ticks until a vehicle4 vehicle reaches the sun (restricted to --max-ticks), "
+                    "stopping when precise enough."
+    )
+    parser.add_argument("--precision", type=float, required=True, help="confidence interval half-width to reach")
+    parser.add_argument("--relative", action="store_true", help="precision as a fraction of the mean")
+    parser.add_argument("--confidence", type=float, default=CONFIDENCE)
+    parser.add_argument("--min-samples", type=int, default=MIN_SAMPLES)
+    parser.add_argument("--max-runs", type=int, default=MAX_RUNS)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--worlds", type=int, default=64, help="vehicles (one per world) per replicate")
+    parser.add_argument("--max-ticks", type=int, default=MAX_TICKS, help="censor vehicles that take longer")
+    parser.add_argument("--max-censored", type=float, default=MAX_CENSORED,
+                        help="largest fraction of censored samples for a converged estimate")
+    parser.add_argument("--inhibition", action=argparse.BooleanOptionalAction, default=False,
+                        help="inhibited vehicles mostly never reach the sun: expect censoring")
+    parser.add_argument("-o", "--output", help="summary file (default: stdout)")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    replicate = functools.partial(
+        ticks_to_sun, worlds=args.worlds, inhibition=args.inhibition, max_ticks=args.max_ticks
+    )
+    runner = MonteCarlo(
+        replicate, args.precision, relative=args.relative, confidence=args.confidence,
+        min_samples=args.min_samples, max_runs=args.max_runs, workers=args.workers, seed=args.seed,
+        cap=args.max_ticks, max_censored=args.max_censored,
+    )
+    text = json.dumps(runner.run()) + "\n"
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+import numpy as np
+
+from simulation import reflected_directions
+
+# Static obstacles for simulation.py: walls and solid discs that vehicles
+# cannot overlap.
+#
+# Every obstacle is a capsule - a segment a-b with a thickness - so a wall is
+# a thin capsule and a disc is a capsule with a == b. The obstacles are
+# indexed once, when the scene is built, in a static grid: each cell lists
+# the obstacles within `reach` (the largest vehicle radius) of it, so a
+# vehicle only tests the few obstacles of its own cell and the cost of a
+# tick does not grow with the number of walls.
+#
+# After every step, vehicles overlapping an obstacle are pushed out along
+# the contact normal, which keeps the part of their motion along the wall
+# (they slide). With reflect=True their heading is also reflected off the
+# wall, like the vehicle-vehicle collisions of vehicle1_final.py.
+
+REACH = 30  # the largest vehicle radius in simulation.MODELS
+ITERATIONS = 3  # push-out passes, for vehicles wedged into corners
+
+
+def polygon_walls(points):
+    # the edges of a closed polygon
+    points = np.asarray(points, dtype=float)
+    return np.stack((points, np.roll(points, -1, axis=0)), axis=1)
+
+
+def box_walls(width, height):
+    return polygon_walls([(0, 0), (width, 0), (width, height), (0, height)])
+
+
+def maze_walls(width, height, spacing, seed=None):
+    # a perfect maze (randomised depth-first search) on a grid of `spacing`
+    # px cells, with the outer box
+    rng = np.random.default_rng(seed)
+    nx, ny = int(width // spacing), int(height // spacing)
+    visited = np.zeros((nx, ny), dtype=bool)
+    open_right = np.zeros((nx, ny), dtype=bool)  # no wall between (x, y) and (x + 1, y)
+    open_down = np.zeros((nx, ny), dtype=bool)  # no wall between (x, y) and (x, y + 1)
+
+    stack = [(0, 0)]
+    visited[0, 0] = True
+    while stack:
+        x, y = stack[-1]
+        neighbours = [
+            (x + dx, y + dy) for dx, dy in ((1, 0), (-1, 0), (0, 1), (0, -1))
+            if 0 <= x + dx < nx and 0 <= y + dy < ny and not visited[x + dx, y + dy]
+        ]
+        if not neighbours:
+            stack.pop()
+            continue
+        nx_, ny_ = neighbours[rng.integers(len(neighbours))]
+        if nx_ != x:
+            open_right[min(x, nx_), y] = True
+        else:
+            open_down[x, min(y, ny_)] = True
+        visited[nx_, ny_] = True
+        stack.append((nx_, ny_))
+
+    walls = []
+    x, y = np.nonzero(~open_right[:-1])
+    walls.append(np.stack(((x + 1, y), (x + 1, y + 1)), axis=0).transpose(2, 0, 1))
+    x, y = np.nonzero(~open_down[:, :-1])
+    walls.append(np.stack(((x, y + 1), (x + 1, y + 1)), axis=0).transpose(2, 0, 1))
+    walls = np.concatenate(walls) * spacing
+    return np.concatenate((walls, box_walls(nx * spacing, ny * spacing)))
+
+
+class Obstacles:
+    def __init__(self, walls=(), discs=(), thickness=1.0, reach=REACH, cell=None, reflect=False):
+        walls = np.asarray(walls, dtype=float).reshape(-1, 2, 2)
+        discs = np.asarray(discs, dtype=float).reshape(-1, 3)  # x, y, radius
+        self.start = np.concatenate((walls[:, 0], discs[:, :2]))
+        self.end = np.concatenate((walls[:, 1], discs[:, :2]))
+        self.thickness = np.concatenate((np.full(len(walls), thickness / 2), discs[:, 2]))
+        self.num_walls = len(walls)
+        self.segment = self.end - self.start
+        length2 = np.einsum("ij,ij->i", self.segment, self.segment)
+        self.inverse_length2 = np.where(length2 > 0, 1 / np.where(length2 > 0, length2, 1), 0)
+        self.reach = reach
+        self.cell = cell or reach
+        self.reflect = reflect
+        self.build()
+
+    def __len__(self):
+        return len(self.thickness)
+
+    def build(self):
+        # CSR layout: the obstacles of cell k are items[offsets[k]:offsets[k + 1]]
+        margin = (self.thickness + self.reach)[:, None]
+        low = np.minimum(self.start, self.end) - margin
+        high = np.maximum(self.start, self.end) + margin
+        self.origin = low.min(axis=0) if len(self) else np.zeros(2)
+        first = np.floor((low - self.origin) / self.cell).astype(np.int64)
+        last = np.floor((high - self.origin) / self.cell).astype(np.int64)
+        self.shape = (last.max(axis=0) + 1) if len(self) else np.ones(2, dtype=np.int64)
+
+        span = last - first + 1
+        counts = span[:, 0] * span[:, 1]
+        item = np.repeat(np.arange(len(self)), counts)
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        cx = first[item, 0] + local // span[item, 1]
+        cy = first[item, 1] + local % span[item, 1]
+        keys = cx * self.shape[1] + cy
+
+        order = np.argsort(keys, kind="stable")
+        self.items = item[order]
+        self.offsets = np.searchsorted(keys[order], np.arange(self.shape[0] * self.shape[1] + 1))
+
+    def candidates(self, points):
+        # (point, obstacle) index pairs for every obstacle listed in each point's cell
+        cells = np.floor((points - self.origin) / self.cell).astype(np.int64)
+        inside = np.flatnonzero(((cells >= 0) & (cells < self.shape)).all(axis=-1))
+        keys = cells[inside, 0] * self.shape[1] + cells[inside, 1]
+        low = self.offsets[keys]
+        counts = self.offsets[keys + 1] - low
+        local = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        return np.repeat(inside, counts), self.items[np.repeat(low, counts) + local]
+
+    def closest_points(self, points, obstacles):
+        a, ab = self.start[obstacles], self.segment[obstacles]
+        t = np.clip(np.einsum("ij,ij->i", points - a, ab) * self.inverse_length2[obstacles], 0, 1)
+        return a + t[:, None] * ab
+
+    def collide(self, sim):
+        if sim.radius > self.reach:
+            raise ValueError(f"obstacles indexed for vehicles up to radius {self.reach}, not {sim.radius}")
+        position = sim.position.reshape(-1, 2)
+        direction = sim.direction.reshape(-1)
+        sensors = (sim.left_sensor_position.reshape(-1, 2), sim.right_sensor_position.reshape(-1, 2))
+
+        # later passes only revisit the vehicles that were pushed
+        active = np.arange(len(position))
+        for _ in range(ITERATIONS):
+            vehicle, obstacle = self.candidates(position[active])
+            vehicle = active[vehicle]
+            points = position[vehicle]
+            delta = points - self.closest_points(points, obstacle)
+            distance = np.sqrt(np.einsum("ij,ij->i", delta, delta))
+            depth = self.thickness[obstacle] + sim.radius - distance
+            hit = depth > 0
+            if not hit.any():
+                break
+            vehicle, obstacle, delta, distance, depth = (
+                vehicle[hit], obstacle[hit], delta[hit], distance[hit], depth[hit]
+            )
+
+            # the deepest contact of every vehicle
+            order = np.lexsort((-depth, vehicle))
+            first = order[np.unique(vehicle[order], return_index=True)[1]]
+            vehicle, obstacle, delta, distance, depth = (
+                vehicle[first], obstacle[first], delta[first], distance[first], depth[first]
+            )
+
+            # centre exactly on a wall: push out along the wall's normal
+            ab = self.segment[obstacle]
+            fallback = np.stack((-ab[:, 1], ab[:, 0]), axis=-1)
+            fallback = np.where((ab == 0).all(axis=-1)[:, None], (0, -1), fallback)
+            normal = np.where((distance > 0)[:, None], delta, fallback)
+            normal /= np.linalg.norm(normal, axis=-1)[:, None]
+
+            push = normal * depth[:, None]
+            position[vehicle] += push
+            for sensor in sensors:
+                sensor[vehicle] += push
+
+            if self.reflect:
+                # only vehicles still heading into the obstacle
+                heading = np.radians(direction[vehicle])
+                into = np.sin(heading) * normal[:, 0] - np.cos(heading) * normal[:, 1] < 0
+                direction[vehicle[into]] = reflected_directions(direction[vehicle[into]], normal[into])
+            active = vehicle
+
+        sim.wrap_positions()
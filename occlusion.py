@@ -0,0 +1,182 @@
+import numpy as np
+
+# Occluded light sensing for simulation.py.
+#
+# The arena is rasterised into an occupancy grid of `cell` px: a cell is
+# blocked when an obstacle (obstacles.py) touches it. Whether a sensor sees
+# a light is decided by walking the grid cells along the line between them
+# (Amanatides & Woo DDA), so a ray costs its length in cells, never one test
+# per obstacle.
+#
+# Obstacles are static, so the answer only depends on the cell of the
+# sensor and the cell of the light: it is cached per light per cell, filled
+# in the first time a sensor enters a cell, and afterwards a sensor just
+# looks it up. When lights move (lights.py) only those that entered another
+# cell start a new table, and recently used tables (up to TABLE_CACHE_BYTES)
+# are kept for lights that come back.
+#
+# With vehicles=True the vehicle bodies block light too. They move every
+# tick, so then every sensor-light ray is marched through the obstacle grid
+# plus the cells covered by vehicles (much more expensive).
+#
+# Rays run inside the arena, also with periodic sensing: a light seen across
+# the wrapping edge is shadowed by what lies on the direct line to it.
+#
+#   sim = Simulation(..., obstacles=walls, occlusion=Occlusion())
+
+OCCLUSION_CELL = 10
+TABLE_CACHE_BYTES = 32 << 20  # visibility tables kept for light cells no longer in use
+UNKNOWN = -1
+
+
+def march(blocked, start, end, cell, layer=None):
+    # True where the segment start-end crosses no blocked cell of the grid
+    # `blocked` ((x, y), or (layers, x, y) with a layer per ray). The cells
+    # of the two end points themselves are not tested; points outside the
+    # grid are moved onto its edge.
+    shape = np.array(blocked.shape[-2:])
+    flat = blocked.reshape(-1)
+    p0 = np.clip(start / cell, 0, shape - 1e-6)
+    p1 = np.clip(end / cell, 0, shape - 1e-6)
+    current = np.floor(p0).astype(np.int64)
+    delta = p1 - p0
+    step = np.sign(delta).astype(np.int64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t_delta = np.abs(1 / delta)
+        t_max = np.where(step != 0, (current + (step > 0) - p0) / delta, np.inf)
+    # cell boundaries crossed before reaching the last cell
+    remaining = np.abs(np.floor(p1).astype(np.int64) - current).sum(axis=-1) - 1
+
+    # walk flat cell indices: a step along x moves by a whole column
+    index = current[:, 0] * shape[1] + current[:, 1]
+    if layer is not None:
+        index += layer * shape[0] * shape[1]
+    move_x, move_y = step[:, 0] * shape[1], step[:, 1]
+    t_x, t_y = t_max[:, 0], t_max[:, 1]
+    t_delta_x, t_delta_y = t_delta[:, 0], t_delta[:, 1]
+
+    visible = np.ones(len(start), dtype=bool)
+    rays = np.flatnonzero(remaining > 0)
+    index, move_x, move_y, t_x, t_y, t_delta_x, t_delta_y, remaining = (
+        a[rays] for a in (index, move_x, move_y, t_x, t_y, t_delta_x, t_delta_y, remaining)
+    )
+    while len(rays):
+        # advance every ray into its next cell, across the nearest boundary
+        along_y = t_y < t_x
+        index += np.where(along_y, move_y, move_x)
+        t_x = np.where(along_y, t_x, t_x + t_delta_x)
+        t_y = np.where(along_y, t_y + t_delta_y, t_y)
+        remaining -= 1
+
+        hit = flat[index]
+        visible[rays[hit]] = False
+        keep = ~hit & (remaining > 0)
+        if not keep.all():
+            rays, index, move_x, move_y, t_x, t_y, t_delta_x, t_delta_y, remaining = (
+                a[keep] for a in (rays, index, move_x, move_y, t_x, t_y, t_delta_x, t_delta_y, remaining)
+            )
+    return visible
+
+
+class Occlusion:
+    def __init__(self, cell=OCCLUSION_CELL, vehicles=False):
+        self.cell = cell
+        self.vehicles = vehicles
+        self.blocked = None
+
+    def reset(self, sim):
+        self.shape = (int(np.ceil(sim.width / self.cell)), int(np.ceil(sim.height / self.cell)))
+        self.blocked = self.rasterise(sim.obstacles)
+        self.light_cells = None
+        self.tables = {}
+        self.dynamic_tick = None
+
+        # cells covered by a vehicle body, relative to the cell of its centre
+        extent = int(sim.radius // self.cell)
+        ox, oy = np.mgrid[-extent:extent + 1, -extent:extent + 1]
+        inside = np.hypot(ox, oy) * self.cell <= sim.radius
+        self.body = np.stack((ox[inside], oy[inside]), axis=-1)
+
+    def rasterise(self, obstacles):
+        blocked = np.zeros(self.shape, dtype=bool)
+        if obstacles is None or not len(obstacles):
+            return blocked
+        if self.cell / 2 ** 0.5 > obstacles.reach:
+            raise ValueError(f"occlusion cells of {self.cell} px are too large for obstacles indexed with "
+                             f"reach {obstacles.reach}")
+        x, y = np.mgrid[:self.shape[0], :self.shape[1]]
+        centres = (np.stack((x.ravel(), y.ravel()), axis=-1) + 0.5) * self.cell
+        # every cell an obstacle touches, so thin diagonal walls leave no gaps
+        point, obstacle = obstacles.candidates(centres)
+        distance = np.linalg.norm(centres[point] - obstacles.closest_points(centres[point], obstacle), axis=-1)
+        touching = distance < obstacles.thickness[obstacle] + self.cell / 2 ** 0.5
+        blocked.reshape(-1)[point[touching]] = True
+        return blocked
+
+    def light_tables(self, sim):
+        # (worlds, lights, x, y) int8 table of each light's visibility from
+        # every cell (UNKNOWN until asked for). A light that entered another
+        # cell swaps its table for the one of its new cell.
+        light_cells = np.stack(self.cells(sim.light_position), axis=-1)
+        if self.light_cells is None:
+            self.visible = np.full((sim.num_worlds, sim.num_lights, *self.shape), UNKNOWN, dtype=np.int8)
+        else:
+            worlds, lights = np.nonzero((light_cells != self.light_cells).any(axis=-1))
+            for world, light in zip(worlds, lights):
+                self.tables[tuple(self.light_cells[world, light])] = self.visible[world, light].copy()
+                key = tuple(light_cells[world, light])
+                if key in self.tables:
+                    self.visible[world, light] = self.tables.pop(key)
+                else:
+                    self.visible[world, light] = UNKNOWN
+            while len(self.tables) > TABLE_CACHE_BYTES // self.visible[0, 0].nbytes:
+                self.tables.pop(next(iter(self.tables)))
+        self.light_cells = light_cells
+        return self.visible
+
+    def cells(self, points):
+        cells = np.floor(points / self.cell).astype(np.int64)
+        return np.clip(cells[..., 0], 0, self.shape[0] - 1), np.clip(cells[..., 1], 0, self.shape[1] - 1)
+
+    def vehicle_grid(self, sim):
+        # obstacles plus vehicle bodies, one layer per world, built once per tick
+        if self.dynamic_tick != sim.tick:
+            grid = np.broadcast_to(self.blocked, (sim.num_worlds, *self.shape)).copy()
+            x, y = self.cells(sim.position)
+            world = np.broadcast_to(np.arange(sim.num_worlds)[:, None], x.shape)
+            for dx, dy in self.body:
+                grid[world, np.clip(x + dx, 0, self.shape[0] - 1), np.clip(y + dy, 0, self.shape[1] - 1)] = True
+            self.grid = grid
+            self.dynamic_tick = sim.tick
+        return self.grid
+
+    def visibility(self, sim, points):
+        # (worlds, vehicles, lights): whether each light is in sight of the points
+        if self.blocked is None:
+            self.reset(sim)
+        if not self.vehicles:
+            table = self.light_tables(sim)
+            x, y = self.cells(points)
+            index = np.broadcast_arrays(
+                np.arange(sim.num_worlds)[:, None, None], np.arange(sim.num_lights)[None, None, :],
+                x[..., None], y[..., None],
+            )
+            visible = table[tuple(index)]
+
+            # march the (cell, light) pairs seen for the first time, cell centre to cell centre
+            unknown = np.flatnonzero(visible.reshape(-1) == UNKNOWN)
+            if len(unknown):
+                world, light, cx, cy = (i.reshape(-1)[unknown] for i in index)
+                pairs = np.unique(np.stack((world, light, cx, cy), axis=-1), axis=0)
+                world, light, cx, cy = pairs.T
+                start = (np.stack((cx, cy), axis=-1) + 0.5) * self.cell
+                end = (self.light_cells[world, light] + 0.5) * self.cell
+                table[world, light, cx, cy] = march(self.blocked, start, end, self.cell)
+                visible = table[tuple(index)]
+            return visible.astype(bool)
+
+        w, n, l = sim.num_worlds, points.shape[1], sim.num_lights
+        start = np.broadcast_to(points[:, :, None, :], (w, n, l, 2)).reshape(-1, 2)
+        end = np.broadcast_to(sim.light_position[:, None, :, :], (w, n, l, 2)).reshape(-1, 2)
+        layer = np.repeat(np.arange(w), n * l)
+        return march(self.vehicle_grid(sim), start.astype(float), end.astype(float), self.cell, layer).reshape(w, n, l)
@@ -0,0 +1,164 @@
+import json
+
+import numpy as np
+
+# Streaming statistics for simulation.py, in constant memory.
+#
+# Add it as a stage (sim.add_stage(OnlineStatistics(...))) and it updates
+# after every step from what the step just did, never storing positions:
+#
+#   - per-vehicle mean/variance of speed and rotation (Welford)
+#   - distance travelled per vehicle
+#   - visits per vehicle and per light, and the tick each light was first
+#     visited in each world
+#   - heading autocorrelation <cos(heading(t) - heading(t - lag))> for a few
+#     lags, from a ring buffer of the last max(lags) headings (in the
+#     simulation's float type: 240 B a vehicle in compact mode with the
+#     default lags, more than the vehicle state itself)
+#
+# Everything is per simulated tick: with an adaptive step size a step
+# counts for the sim.step_dt ticks it covered.
+#
+# With snapshot_path set, a JSON line with the population summary is
+# appended every `snapshot_every` ticks.
+
+LAGS = (1, 10, 60)
+TINY = np.finfo(float).tiny
+
+
+class Welford:
+    def __init__(self, shape):
+        self.count = 0
+        self.mean = np.zeros(shape)
+        self.m2 = np.zeros(shape)
+
+    def update(self, values, weight=1):
+        # `weight` is how many samples `values` stands for (West's weighted
+        # form), e.g. the ticks an adaptive step covered; 0 changes nothing
+        self.count = self.count + weight
+        delta = values - self.mean
+        self.mean += delta * weight / np.maximum(self.count, TINY)
+        self.m2 += weight * delta * (values - self.mean)
+
+    def variance(self):
+        count = np.asarray(self.count)
+        return np.where(count > 1, self.m2 / np.maximum(count - 1, TINY), 0.0)
+
+    def pooled(self, axis):
+        # mean and variance over all samples of the elements along `axis`
+        # (Chan et al. combination of groups)
+        count = np.broadcast_to(self.count, self.mean.shape)
+        total = count.sum(axis=axis)
+        mean = (count * self.mean).sum(axis=axis) / np.maximum(total, TINY)
+        spread = (count * (self.mean - np.expand_dims(mean, axis)) ** 2).sum(axis=axis)
+        m2 = self.m2.sum(axis=axis) + spread
+        return mean, np.where(total > 1, m2 / np.maximum(total - 1, TINY), 0.0)
+
+
+class OnlineStatistics:
+    def __init__(self, lags=LAGS, snapshot_path=None, snapshot_every=10000, per_vehicle=False):
+        self.lags = lags
+        self.snapshot_path = snapshot_path
+        self.snapshot_every = snapshot_every
+        self.per_vehicle = per_vehicle
+
+    def reset(self, sim):
+        w, n, l = sim.num_worlds, sim.num_vehicles, sim.num_lights
+        self.ticks = 0
+        self.time = np.zeros(w)
+        self.speed = Welford((w, n))
+        self.rotation = Welford((w, n))
+        self.distance = np.zeros((w, n))
+        self.vehicle_visits = np.zeros((w, n), dtype=np.int64)
+        self.light_visits = np.zeros((w, l), dtype=np.int64)
+        self.first_visit = np.full((w, l), -1, dtype=np.int64)
+
+        self.headings = np.zeros((max(self.lags), w, n), dtype=sim.float)
+        self.heading_ticks = np.zeros(w, dtype=np.int64)
+        self.correlation = np.zeros((len(self.lags), w))
+        self.correlation_count = np.zeros((len(self.lags), w), dtype=np.int64)
+
+    def update(self, sim):
+        # a step stands for the sim.step_dt ticks it covered (1 unless the
+        # step size is adaptive, 0 for a rejected step)
+        weight = sim.step_dt[:, None]
+        self.speed.update(sim.speed, weight)
+        self.rotation.update(sim.rotation, weight)
+        self.distance += np.abs(sim.speed) * weight
+        self.time += sim.step_dt
+
+        if sim.visiting.any():
+            worlds, vehicles = np.nonzero(sim.visiting)
+            lights = sim.visited_light[worlds, vehicles]
+            np.add.at(self.vehicle_visits, (worlds, vehicles), 1)
+            np.add.at(self.light_visits, (worlds, lights), 1)
+            first = self.first_visit[worlds, lights] < 0
+            self.first_visit[worlds[first], lights[first]] = sim.tick
+
+        # headings are sampled once per whole simulated tick, so the lags are
+        # in ticks; a step covering several ticks holds its heading for all
+        heading = np.radians(sim.direction)
+        size = len(self.headings)
+        whole = np.floor(self.time + 1e-9).astype(np.int64)
+        while (self.heading_ticks < whole).any():
+            worlds = np.flatnonzero(self.heading_ticks < whole)
+            ticks = self.heading_ticks[worlds]
+            for i, lag in enumerate(self.lags):
+                past = ticks >= lag
+                if past.any():
+                    lagged = worlds[past]
+                    previous = self.headings[(ticks[past] - lag) % size, lagged]
+                    self.correlation[i, lagged] += np.cos(heading[lagged] - previous).mean(axis=-1)
+                    self.correlation_count[i, lagged] += 1
+            self.headings[ticks % size, worlds] = heading[worlds]
+            self.heading_ticks[worlds] += 1
+        self.ticks += 1
+
+        if self.snapshot_path and self.ticks % self.snapshot_every == 0:
+            self.write_snapshot(sim)
+
+    @property
+    def nbytes(self):
+        # counted in sim.memory_report(); mostly the heading ring buffer
+        arrays = [self.speed.mean, self.speed.m2, self.rotation.mean, self.rotation.m2, self.distance,
+                  self.vehicle_visits, self.headings]
+        return sum(array.nbytes for array in arrays)
+
+    def autocorrelation(self):
+        # (lags, worlds)
+        return self.correlation / np.maximum(1, self.correlation_count)
+
+    def summary(self, sim):
+        speed_mean, speed_var = self.speed.pooled(axis=1)
+        rotation_mean, rotation_var = self.rotation.pooled(axis=1)
+        time = np.maximum(1, self.time)
+        summary = {
+            "tick": int(sim.tick),
+            "ticks": self.ticks,
+            "speed_mean": speed_mean.tolist(),
+            "speed_var": speed_var.tolist(),
+            "rotation_mean": rotation_mean.tolist(),
+            "rotation_var": rotation_var.tolist(),
+            "distance_mean": self.distance.mean(axis=1).tolist(),
+            "light_visits": self.light_visits.tolist(),
+            "light_visit_rate": (self.light_visits / time[:, None]).tolist(),
+            "first_visit": self.first_visit.tolist(),
+            "vehicle_visit_rate_mean": (self.vehicle_visits / time[:, None]).mean(axis=1).tolist(),
+            "heading_autocorrelation": {
+                str(lag): values.tolist() for lag, values in zip(self.lags, self.autocorrelation())
+            },
+        }
+        if self.per_vehicle:
+            summary.update(
+                vehicle_speed_mean=self.speed.mean.tolist(),
+                vehicle_speed_var=self.speed.variance().tolist(),
+                vehicle_rotation_mean=self.rotation.mean.tolist(),
+                vehicle_rotation_var=self.rotation.variance().tolist(),
+                vehicle_distance=self.distance.tolist(),
+                vehicle_visits=self.vehicle_visits.tolist(),
+            )
+        return summary
+
+    def write_snapshot(self, sim):
+        with open(self.snapshot_path, "a") as f:
+            f.write(json.dumps(self.summary(sim)) + "\n")
@@ -0,0 +1,81 @@
+import numpy as np
+
+# Pheromone field for simulation.py: a scalar field on a coarse grid over
+# the arena (one layer per world) that vehicles deposit into and sense with
+# their sensors, on top of the light.
+#
+# Every tick each vehicle adds `deposit` to the cell it is in (one bincount
+# for all vehicles). Every `every` ticks the field diffuses (explicit
+# five-point Laplacian with np.roll, wrapping like the arena) and
+# evaporates, with the rates scaled to the elapsed ticks (diffusion in as
+# many explicit sub-steps as stability needs, rate <= 1/4). A sensor reads
+# `gain` times the value of its cell, added to what it gets from the lights;
+# sensors sticking out of the arena read the cell across the edge.
+#
+#   sim = Simulation(3000, 1, "vehicle5", pheromone=PheromoneField(gain=0.05))
+
+PHEROMONE_CELL = 10
+DIFFUSION = 0.1  # cell^2 per tick
+EVAPORATION = 0.01  # fraction lost per tick
+
+
+class PheromoneField:
+    def __init__(self, cell=PHEROMONE_CELL, deposit=1.0, diffusion=DIFFUSION, evaporation=EVAPORATION, gain=0.01,
+                 every=1):
+        self.cell = cell
+        self.deposit = deposit
+        self.diffusion = diffusion
+        self.evaporation = evaporation
+        self.gain = gain
+        self.every = every
+
+    def reset(self, sim):
+        self.shape = (int(np.ceil(sim.width / self.cell)), int(np.ceil(sim.height / self.cell)))
+        self.field = np.zeros((sim.num_worlds, *self.shape), dtype=sim.float)
+        self.pending = np.zeros(self.field.size, dtype=sim.float)
+        self.ticks = 0
+        self.elapsed = np.zeros(sim.num_worlds)  # simulated ticks since the field last evolved
+
+    def cells(self, points):
+        # flat indices into self.field, per world
+        cells = np.floor(points / self.cell).astype(np.int64)
+        x = cells[..., 0] % self.shape[0]
+        y = cells[..., 1] % self.shape[1]
+        world = np.arange(points.shape[0]).reshape(-1, *([1] * (points.ndim - 2)))
+        return (world * self.shape[0] + x) * self.shape[1] + y
+
+    def sense(self, sim, points):
+        # (worlds, vehicles)
+        return self.gain * self.field.reshape(-1)[self.cells(points)]
+
+    def update(self, sim):
+        # a step deposits and evolves the field for the sim.step_dt ticks it
+        # covered (1 unless the step size is adaptive)
+        cells = self.cells(sim.position).reshape(-1)
+        weights = np.repeat(sim.step_dt * self.deposit, sim.num_vehicles)
+        self.pending += np.bincount(cells, weights, minlength=self.field.size)
+        self.elapsed += sim.step_dt
+        self.ticks += 1
+        if self.ticks % self.every:
+            return
+
+        field = self.field
+        field += self.pending.reshape(field.shape)
+        self.pending[:] = 0
+        if self.diffusion:
+            substeps = int(np.ceil(self.diffusion * self.elapsed.max() / 0.25))
+            if substeps:
+                rate = (self.diffusion * self.elapsed / substeps).astype(field.dtype).reshape(-1, 1, 1)
+                for _ in range(substeps):
+                    laplacian = (
+                        np.roll(field, 1, axis=1) + np.roll(field, -1, axis=1)
+                        + np.roll(field, 1, axis=2) + np.roll(field, -1, axis=2) - 4 * field
+                    )
+                    field += rate * laplacian
+        if self.evaporation:
+            field *= ((1 - self.evaporation) ** self.elapsed).astype(field.dtype).reshape(-1, 1, 1)
+        self.elapsed[:] = 0
+
+    def total(self):
+        # pheromone per world
+        return self.field.sum(axis=(1, 2)) + self.pending.reshape(self.field.shape).sum(axis=(1, 2))
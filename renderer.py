@@ -0,0 +1,198 @@
+import numpy as np
+import pygame
+
+# Level-of-detail vehicle renderer.
+#
+#   full   - body, heading dot and both sensors with pygame.draw (as vehicle5.py)
+#   sprite - one pre-rendered sprite per (heading bucket, zoom, mono) blitted
+#            with a single Surface.blits() call
+#   pixel  - one pixel per vehicle (brighter where several overlap) written
+#            straight into the screen with pygame.surfarray
+#
+# In "auto" mode the level follows the on-screen vehicle size and the number
+# of visible vehicles, so a zoomed-out 50k swarm costs one counting pass and one
+# array write instead of 200k draw calls.
+#
+# HeatmapOverlay draws an occupancy grid (heatmap.py) under the vehicles.
+
+WHITE = (255, 255, 255)
+RED = (255, 0, 0)
+GREEN = (0, 255, 0)
+
+LEVELS = ["auto", "full", "sprite", "pixel"]
+
+SPRITE_COUNT = 300  # more visible vehicles than this: sprites
+PIXEL_COUNT = 5000  # more visible vehicles than this: pixels
+SPRITE_SIZE = 6  # on-screen radius (px) below which sprites are used
+PIXEL_SIZE = 1.5  # on-screen radius (px) below which pixels are used
+HEADING_BUCKETS = 64
+
+
+class VehicleRenderer:
+    def __init__(self, radius, sensor_radius, sensor_spacing, color=RED):
+        self.radius = radius
+        self.sensor_radius = sensor_radius
+        self.sensor_offset = radius + sensor_radius
+        self.sensor_spacing = sensor_spacing
+        self.color = color
+        self.level = "auto"
+        self.sprites = {}
+
+    def cycle_level(self):
+        self.level = LEVELS[(LEVELS.index(self.level) + 1) % len(LEVELS)]
+
+    def choose_level(self, visible_count, zoom):
+        if self.level != "auto":
+            return self.level
+        size = self.radius * zoom
+        if size < PIXEL_SIZE or visible_count > PIXEL_COUNT:
+            return "pixel"
+        if size < SPRITE_SIZE or visible_count > SPRITE_COUNT:
+            return "sprite"
+        return "full"
+
+    def cull(self, frame, camera):
+        # indices of the vehicles intersecting the viewport and the level to draw them at
+        reach = self.radius + 2 * self.sensor_radius + self.sensor_spacing
+        visible = np.flatnonzero(camera.visible(frame["position"], reach))
+        return visible, self.choose_level(len(visible), camera.zoom)
+
+    def draw(self, surface, frame, camera, visible, level, mono=False):
+        if level == "full":
+            self.draw_full(surface, frame, camera, visible)
+        elif level == "sprite":
+            self.draw_sprites(surface, frame, camera, visible, mono)
+        else:
+            self.draw_pixels(surface, frame, camera, visible)
+
+    def draw_full(self, surface, frame, camera, visible):
+        zoom = camera.zoom
+        positions = camera.world_to_screen(frame["position"][visible])
+        left_sensors = camera.world_to_screen(frame["left_sensor_position"][visible])
+        right_sensors = camera.world_to_screen(frame["right_sensor_position"][visible])
+        directions = frame["direction"][visible]
+
+        for position, direction, left, right in zip(positions, directions, left_sensors, right_sensors):
+            pygame.draw.circle(surface, self.color, position, max(1, self.radius * zoom))
+            forward = pygame.math.Vector2(0, -1).rotate(float(direction))
+            end_pos = pygame.math.Vector2(*position) + forward * (self.radius - 5) * zoom
+            pygame.draw.circle(surface, WHITE, end_pos, max(1, 3 * zoom))
+            pygame.draw.circle(surface, GREEN, left, max(1, self.sensor_radius * zoom))
+            pygame.draw.circle(surface, GREEN, right, max(1, self.sensor_radius * zoom))
+
+    def sprite(self, bucket, zoom, mono):
+        key = (bucket, round(zoom, 3), mono)
+        if key not in self.sprites:
+            if len(self.sprites) > 4 * HEADING_BUCKETS:
+                # zoom changed: drop the sprites rendered for older zoom levels
+                self.sprites.clear()
+
+            spacing = 0 if mono else self.sensor_spacing
+            extent = (self.sensor_offset + self.sensor_radius + spacing / 2) * zoom
+            size = int(np.ceil(extent)) + 1
+            sprite = pygame.Surface((2 * size, 2 * size), pygame.SRCALPHA)
+            center = pygame.math.Vector2(size, size)
+
+            forward = pygame.math.Vector2(0, -1).rotate(bucket * 360 / HEADING_BUCKETS)
+            right = forward.rotate(-90)
+            ahead = center + forward * self.sensor_offset * zoom
+            pygame.draw.circle(sprite, self.color, center, max(1, self.radius * zoom))
+            pygame.draw.circle(sprite, WHITE, center + forward * (self.radius - 5) * zoom, max(1, 3 * zoom))
+            pygame.draw.circle(sprite, GREEN, ahead - right * spacing / 2 * zoom, max(1, self.sensor_radius * zoom))
+            pygame.draw.circle(sprite, GREEN, ahead + right * spacing / 2 * zoom, max(1, self.sensor_radius * zoom))
+            self.sprites[key] = (sprite, size)
+        return self.sprites[key]
+
+    def draw_sprites(self, surface, frame, camera, visible, mono):
+        positions = camera.world_to_screen(frame["position"][visible])
+        buckets = np.rint(frame["direction"][visible] % 360 * HEADING_BUCKETS / 360).astype(int) % HEADING_BUCKETS
+
+        blits = []
+        for bucket, (x, y) in zip(buckets, positions):
+            sprite, size = self.sprite(bucket, camera.zoom, mono)
+            blits.append((sprite, (x - size, y - size)))
+        surface.blits(blits, doreturn=False)
+
+    def draw_pixels(self, surface, frame, camera, visible):
+        width, height = surface.get_size()
+        points = np.floor(camera.world_to_screen(frame["position"][visible])).astype(np.int64)
+        inside = (points[:, 0] >= 0) & (points[:, 0] < width) & (points[:, 1] >= 0) & (points[:, 1] < height)
+        points = points[inside]
+        if not len(points):
+            return
+
+        # vehicles per pixel, brighter where the swarm is denser
+        cells = points[:, 0] * height + points[:, 1]
+        cells, counts = np.unique(cells, return_counts=True)
+        heat = np.minimum(255, 96 + 40 * counts)
+
+        pixels = pygame.surfarray.pixels3d(surface)
+        pixels[cells // height, cells % height] = np.outer(heat, self.color) // 255
+        del pixels  # unlock the surface
+
+
+class HeatmapOverlay:
+    # Cached low-resolution surface of an occupancy grid (heatmap.py), one
+    # pixel per cell. refresh() re-colours only the cells whose count changed
+    # since the last upload, and at most every `refresh_ms`; draw() scales
+    # just the part of it inside the viewport.
+    def __init__(self, shape, cell, saturation=500, refresh_ms=200):
+        self.cell = cell
+        self.saturation = saturation
+        self.refresh_ms = refresh_ms
+        self.surface = pygame.Surface(shape, pygame.SRCALPHA)
+        self.surface.fill((0, 0, 0, 0))
+        self.uploaded = np.zeros(shape, dtype=np.uint32)
+        self.last_refresh = None
+        self.enabled = False
+
+    def toggle(self):
+        self.enabled = not self.enabled
+
+    def clear(self):
+        self.surface.fill((0, 0, 0, 0))
+        self.uploaded[:] = 0
+
+    def refresh(self, counts, now):
+        if self.last_refresh is not None and now - self.last_refresh < self.refresh_ms:
+            return
+        self.last_refresh = now
+
+        counts = counts.copy()
+        if (counts < self.uploaded).any():
+            # the simulation was reset
+            self.clear()
+        x, y = np.nonzero(counts != self.uploaded)
+        if not len(x):
+            return
+
+        # log scale against a fixed saturation, so a cell's colour depends on
+        # its own count only and unchanged cells never need re-uploading
+        level = np.minimum(1.0, np.log1p(counts[x, y]) / np.log1p(self.saturation))
+        rgb = pygame.surfarray.pixels3d(self.surface)
+        rgb[x, y] = np.stack(
+            (np.full_like(level, 255), 220 * (1 - level), 40 * (1 - level)), axis=-1
+        ).astype(np.uint8)
+        del rgb
+        alpha = pygame.surfarray.pixels_alpha(self.surface)
+        alpha[x, y] = (60 + 160 * level).astype(np.uint8)
+        del alpha
+
+        self.uploaded[x, y] = counts[x, y]
+
+    def draw(self, surface, camera):
+        width, height = self.surface.get_size()
+        left, top, right, bottom = camera.visible_rect()
+        x0 = int(np.clip(left // self.cell, 0, width))
+        y0 = int(np.clip(top // self.cell, 0, height))
+        x1 = int(np.clip(right // self.cell + 1, 0, width))
+        y1 = int(np.clip(bottom // self.cell + 1, 0, height))
+        if x1 <= x0 or y1 <= y0:
+            return
+
+        size = self.cell * camera.zoom
+        visible = self.surface.subsurface((x0, y0, x1 - x0, y1 - y0))
+        scaled = pygame.transform.scale(
+            visible, (max(1, round((x1 - x0) * size)), max(1, round((y1 - y0) * size)))
+        )
+        surface.blit(scaled, camera.world_to_screen((x0 * self.cell, y0 * self.cell)))
@@ -0,0 +1,130 @@
+import hashlib
+import io
+import json
+import os
+import zipfile
+
+import numpy as np
+
+# On-disk cache of run results, addressed by the content of the run.
+#
+# The key is a SHA-256 of the run specification (a JSON-able dict of
+# everything that decides the result: model, toggles, noise, vehicles,
+# lights, ticks, seed, ...) together with the source of the engine modules,
+# so editing the simulation code invalidates every entry made with the old
+# code. An entry is one .npz file holding the summary (as JSON) and
+# optionally a trajectory array.
+#
+# Reading an entry touches it; when the directory grows past max_bytes the
+# least recently used entries are removed.
+#
+#   cache = ResultCache()
+#   hit = cache.get(spec)
+#   if hit is None:
+#       summary, trajectory = run(...)
+#       cache.put(spec, summary, trajectory)
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "valentino")
+MAX_BYTES = 1 << 30
+ROOT = os.path.dirname(os.path.abspath(__file__))
+# the modules a run's result depends on
+SOURCES = [
+    "simulation.py", "counter_rng.py", "obstacles.py", "occlusion.py", "lights.py", "pheromone.py",
+    "light_index.py", "online_stats.py", "run_batch.py",
+]
+
+
+def code_version(sources=SOURCES):
+    digest = hashlib.sha256()
+    for name in sources:
+        with open(os.path.join(ROOT, name), "rb") as f:
+            digest.update(name.encode() + b"\0" + f.read() + b"\0")
+    return digest.hexdigest()
+
+
+def spec_key(spec, version):
+    text = json.dumps(spec, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256((version + "\0" + text).encode()).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, directory=CACHE_DIR, max_bytes=MAX_BYTES, sources=SOURCES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.version = code_version(sources)
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, spec):
+        return os.path.join(self.directory, spec_key(spec, self.version) + ".npz")
+
+    def get(self, spec):
+        # (summary, trajectory or None), or None when the run is not cached
+        path = self.path(spec)
+        try:
+            with np.load(path) as entry:
+                summary = json.loads(str(entry["summary"]))
+                trajectory = entry["trajectory"] if "trajectory" in entry else None
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, ValueError, KeyError, zipfile.BadZipFile):
+            # a damaged entry is a miss, and is removed so it gets rewritten
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            return None
+        # another process may have evicted it since; the result is still good
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            pass
+        return summary, trajectory
+
+    def put(self, spec, summary, trajectory=None):
+        arrays = {"summary": np.array(json.dumps(summary))}
+        if trajectory is not None:
+            arrays["trajectory"] = trajectory
+        buffer = io.BytesIO()
+        np.savez(buffer, **arrays)
+
+        # written under a temporary name, so readers never see half an entry
+        path = self.path(spec)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as f:
+            f.write(buffer.getvalue())
+        os.replace(temporary, path)
+        self.evict()
+
+    def entries(self):
+        # (last use, bytes, path) of every entry, least recently used first
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".npz"):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue  # removed by another process meanwhile
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return sorted(entries)
+
+    def size(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+    def clear(self):
+        for _, _, path in self.entries():
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
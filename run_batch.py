@@ -0,0 +1,254 @@
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+
+import numpy as np
+
+from light_index import LightIndex
+from lights import LightMotion
+from obstacles import Obstacles, box_walls, maze_walls
+from occlusion import Occlusion
+from online_stats import OnlineStatistics
+from pheromone import PheromoneField
+from result_cache import CACHE_DIR, MAX_BYTES, ResultCache
+from simulation import EXPLORATION_NOISE, MODELS, Simulation
+
+# Headless batch runs from the command line, one run per process.
+#
+#   python run_batch.py --model vehicle4 --ticks 10000 --seed 3 --inhibition
+#   python run_batch.py --vehicles 1000 --worlds 8 --format csv -o run.csv
+#   python run_batch.py --scenario maze --trajectory run.npz --every 10
+#
+# The summary (online_stats.OnlineStatistics plus the run settings and its
+# wall time) goes to stdout or --output as JSON, or as CSV with one row per
+# world. The memory report goes to stderr.
+#
+# With --cache, runs whose specification (every option that changes the
+# result) and engine code were seen before are read back from an on-disk
+# cache (result_cache.py) instead of simulated again.
+
+SCENARIOS = {
+    "open": dict(walls=None, occlusion=False),
+    "box": dict(walls="box", occlusion=False),
+    "maze": dict(walls="maze", occlusion=False),
+    "maze_occluded": dict(walls="maze", occlusion=True),
+}
+MAZE_SPACING = 200
+TOGGLES = ["mono", "friction", "inhibition", "cross"]
+# options that only say where and how results are written
+OUTPUT_OPTIONS = ["format", "output", "trajectory", "cache", "cache_size"]
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Run a simulation headless and print a summary.")
+    parser.add_argument("--model", default="vehicle5", choices=list(MODELS))
+    parser.add_argument("--scenario", default="open", choices=list(SCENARIOS))
+    parser.add_argument("--ticks", type=int, default=1000, help="ticks to simulate (--adaptive: steps of sim.dt)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--vehicles", type=int, default=1)
+    parser.add_argument("--worlds", type=int, default=1)
+    parser.add_argument("--lights", type=int, help="number of lights, placed at random (default: the model's)")
+    parser.add_argument("--light-drift", type=float, default=0.0, help="random walk of the lights, px per tick")
+    parser.add_argument("--light-moving", type=float, default=1.0, help="fraction of the lights moving each tick")
+    parser.add_argument("--light-orbit", type=float, default=0.0, help="radius of circular light motion")
+    parser.add_argument("--light-pulse", type=float, default=0.0, help="depth of the light intensity pulse")
+    parser.add_argument("--pheromone", type=float, help="sense a pheromone field with this gain")
+    parser.add_argument("--pheromone-every", type=int, default=1, help="evolve the pheromone field every N ticks")
+    parser.add_argument("--light-index", action="store_true", help="visit detection through a grid of the lights")
+    parser.add_argument("--periodic", action="store_true", help="sense lights across the wrapping edges")
+    parser.add_argument("--width", type=int)
+    parser.add_argument("--height", type=int)
+    for toggle in TOGGLES:
+        parser.add_argument(f"--{toggle}", action=argparse.BooleanOptionalAction, help="default: the model's")
+    parser.add_argument("--noise", type=float, default=EXPLORATION_NOISE, help="exploration noise (vehicle5)")
+    parser.add_argument("--adaptive", action="store_true", help="adaptive step size (vehicle2-4)")
+    parser.add_argument("--compact", action="store_true", help="float32 state")
+    parser.add_argument("--heading-table", action="store_true", help="headings from a sine table instead of sin/cos")
+    parser.add_argument("--counter-noise", action="store_true",
+                        help="noise keyed by (world, vehicle, tick): the same whatever --worlds and --vehicles")
+    parser.add_argument("--format", default="json", choices=["json", "csv"])
+    parser.add_argument("-o", "--output", help="summary file (default: stdout)")
+    parser.add_argument("--trajectory", help="record positions and headings to a .npz or .csv file")
+    parser.add_argument("--every", type=int, default=1, help="record the trajectory every N ticks")
+    parser.add_argument("--cache", nargs="?", const=CACHE_DIR, help=f"reuse cached results (default: {CACHE_DIR})")
+    parser.add_argument("--cache-size", type=float, default=MAX_BYTES / 2**20, help="cache size bound, MB")
+    return parser.parse_args(argv)
+
+
+def build_simulation(args):
+    params = MODELS[args.model]
+    width, height = args.width or params["width"], args.height or params["height"]
+
+    lights = None
+    if args.lights is not None:
+        rng = np.random.default_rng([args.seed, 1])
+        lights = rng.uniform((0, 0), (width, height), (args.lights, 2))
+
+    scenario = SCENARIOS[args.scenario]
+    obstacles = None
+    if scenario["walls"] == "box":
+        obstacles = Obstacles(box_walls(width, height))
+    elif scenario["walls"] == "maze":
+        obstacles = Obstacles(maze_walls(width, height, MAZE_SPACING, seed=args.seed))
+
+    sim = Simulation(
+        args.vehicles, args.worlds, args.model, width, height, seed=args.seed, lights=lights, compact=args.compact,
+        obstacles=obstacles, occlusion=Occlusion() if scenario["occlusion"] else None,
+        pheromone=None if args.pheromone is None else PheromoneField(gain=args.pheromone, every=args.pheromone_every),
+        periodic=args.periodic, counter_noise=args.counter_noise, heading_table=args.heading_table,
+        light_index=LightIndex() if args.light_index else None,
+    )
+    for toggle in TOGGLES:
+        if getattr(args, toggle) is not None:
+            getattr(sim, toggle)[:] = getattr(args, toggle)
+    sim.exploration_noise[:] = args.noise
+    sim.adaptive = args.adaptive
+    if args.light_drift or args.light_orbit or args.light_pulse:
+        sim.add_stage(LightMotion(
+            drift=args.light_drift, moving=args.light_moving, orbit_radius=args.light_orbit,
+            pulse_depth=args.light_pulse, seed=[args.seed, 2],
+        ))
+    return sim
+
+
+def run(args):
+    sim = build_simulation(args)
+    stats = sim.add_stage(OnlineStatistics())
+    print(sim.memory_report(), file=sys.stderr)
+
+    trajectory = None
+    if args.trajectory:
+        frames = args.ticks // args.every
+        trajectory = np.zeros((frames, sim.num_worlds, sim.num_vehicles, 3), dtype=np.float32)
+
+    start = time.perf_counter()
+    if args.adaptive:
+        # --ticks of simulated time, in chunks that end on the frame times
+        steps = 0
+        chunk = args.every if trajectory is not None else args.ticks
+        for index in range(args.ticks // chunk):
+            steps += sim.advance(chunk)
+            if trajectory is not None:
+                trajectory[index, ..., :2] = sim.position
+                trajectory[index, ..., 2] = sim.direction
+        if args.ticks % chunk:
+            steps += sim.advance(args.ticks % chunk)
+    else:
+        steps = args.ticks
+        for tick in range(args.ticks):
+            sim.step()
+            if trajectory is not None and (tick + 1) % args.every == 0:
+                frame = trajectory[(tick + 1) // args.every - 1]
+                frame[..., :2] = sim.position
+                frame[..., 2] = sim.direction
+    elapsed = time.perf_counter() - start
+
+    summary = {
+        "model": args.model,
+        "scenario": args.scenario,
+        "seed": args.seed,
+        "periodic": args.periodic,
+        "worlds": sim.num_worlds,
+        "vehicles": sim.num_vehicles,
+        "lights": sim.num_lights,
+        "toggles": {toggle: getattr(sim, toggle).tolist() for toggle in TOGGLES},
+        "simulated_time": sim.time.tolist(),
+        "steps": steps,
+        "wall_time": elapsed,
+        "ticks_per_second": args.ticks / elapsed if elapsed > 0 else None,
+        "bytes_per_vehicle": sim.bytes_per_vehicle(),
+    }
+    summary.update(stats.summary(sim))
+    return summary, trajectory
+
+
+def run_spec(args):
+    # everything that decides the result of a run
+    spec = {key: value for key, value in vars(args).items() if key not in OUTPUT_OPTIONS}
+    spec["trajectory"] = bool(args.trajectory)
+    return spec
+
+
+def cached_run(args):
+    cache = ResultCache(args.cache, int(args.cache_size * 2**20))
+    spec = run_spec(args)
+    hit = cache.get(spec)
+    if hit is not None:
+        summary, trajectory = hit
+        summary["cached"] = True
+        return summary, trajectory
+    summary, trajectory = run(args)
+    cache.put(spec, summary, trajectory)
+    summary["cached"] = False
+    return summary, trajectory
+
+
+def csv_rows(summary):
+    # one row per world, per-light and per-lag values in their own columns
+    rows = []
+    for world in range(summary["worlds"]):
+        row = {
+            "model": summary["model"],
+            "scenario": summary["scenario"],
+            "seed": summary["seed"],
+            "world": world,
+            "vehicles": summary["vehicles"],
+            "ticks": summary["ticks"],
+            "wall_time": summary["wall_time"],
+        }
+        for toggle, values in summary["toggles"].items():
+            row[toggle] = values[world]
+        for key in ["speed_mean", "speed_var", "rotation_mean", "rotation_var", "distance_mean",
+                    "vehicle_visit_rate_mean", "simulated_time"]:
+            row[key] = summary[key][world]
+        for light, (visits, first) in enumerate(zip(summary["light_visits"][world], summary["first_visit"][world])):
+            row[f"light{light}_visits"] = visits
+            row[f"light{light}_first_visit"] = first
+        for lag, values in summary["heading_autocorrelation"].items():
+            row[f"autocorrelation_{lag}"] = values[world]
+        rows.append(row)
+    return rows
+
+
+def format_summary(summary, format):
+    if format == "json":
+        return json.dumps(summary) + "\n"
+    rows = csv_rows(summary)
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=list(rows[0]))
+    writer.writeheader()
+    writer.writerows(rows)
+    return out.getvalue()
+
+
+def write_trajectory(path, trajectory, every):
+    if path.endswith(".csv"):
+        frames, worlds, vehicles, _ = trajectory.shape
+        tick, world, vehicle = np.meshgrid(
+            (np.arange(frames) + 1) * every, np.arange(worlds), np.arange(vehicles), indexing="ij"
+        )
+        columns = np.column_stack((tick.ravel(), world.ravel(), vehicle.ravel(), trajectory.reshape(-1, 3)))
+        np.savetxt(path, columns, delimiter=",", header="tick,world,vehicle,x,y,direction", comments="",
+                   fmt=["%d", "%d", "%d", "%.4f", "%.4f", "%.4f"])
+    else:
+        np.savez_compressed(path, trajectory=trajectory, every=every)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    summary, trajectory = cached_run(args) if args.cache else run(args)
+    text = format_summary(summary, args.format)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+    if trajectory is not None:
+        write_trajectory(args.trajectory, trajectory, args.every)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,208 @@
+import multiprocessing
+import queue
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from heatmap import OccupancyGrid, grid_shape
+from simulation import Simulation
+
+# Double-buffered simulation state in shared memory.
+#
+# The simulation process always writes into the slot that is *not* the
+# latest one and flips `latest` when the write is complete, so the viewer
+# can copy the latest complete state without ever blocking the writer.
+# Every slot carries a sequence number that is odd while the slot is being
+# written; a reader that sees it change (or odd) during its copy retries.
+
+HEADER = ["latest", "seq0", "seq1"]
+TOGGLES = ["mono", "friction", "inhibition", "cross"]
+
+
+def state_fields(num_vehicles, num_lights):
+    return [
+        ("tick", ()),
+        ("position", (num_vehicles, 2)),
+        ("direction", (num_vehicles,)),
+        ("left_sensor_position", (num_vehicles, 2)),
+        ("right_sensor_position", (num_vehicles, 2)),
+        ("light_position", (num_lights, 2)),
+        ("light_intensity", (num_lights,)),
+        ("visited_count", (num_lights,)),
+        ("toggles", (len(TOGGLES),)),
+        ("exploration_noise", ()),
+    ]
+
+
+class DoubleBuffer:
+    def __init__(self, num_vehicles, num_lights, name=None):
+        self.num_vehicles = num_vehicles
+        self.num_lights = num_lights
+        self.fields = state_fields(num_vehicles, num_lights)
+        self.slot_size = sum(int(np.prod(shape)) for _, shape in self.fields)
+
+        nbytes = (len(HEADER) + 2 * self.slot_size) * 8
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+
+        self.header = np.ndarray((len(HEADER),), dtype=np.int64, buffer=self.shm.buf)
+        data = np.ndarray(
+            (2, self.slot_size), dtype=np.float64, buffer=self.shm.buf, offset=len(HEADER) * 8
+        )
+        self.slots = [self._views(data[i]) for i in range(2)]
+        if self.owner:
+            self.header[:] = 0
+            data[:] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _views(self, flat):
+        views = {}
+        offset = 0
+        for field, shape in self.fields:
+            size = int(np.prod(shape))
+            views[field] = flat[offset:offset + size].reshape(shape)
+            offset += size
+        return views
+
+    def write(self, sim, world=0):
+        slot = 1 - self.header[0]
+        seq = 1 + slot
+        views = self.slots[slot]
+
+        self.header[seq] += 1  # odd: write in progress
+        views["tick"][...] = sim.tick
+        views["position"][:] = sim.position[world]
+        views["direction"][:] = sim.direction[world]
+        views["left_sensor_position"][:] = sim.left_sensor_position[world]
+        views["right_sensor_position"][:] = sim.right_sensor_position[world]
+        views["light_position"][:] = sim.light_position[world]
+        views["light_intensity"][:] = sim.light_intensity[world]
+        views["visited_count"][:] = sim.visited_count[world]
+        views["toggles"][:] = [getattr(sim, toggle)[world] for toggle in TOGGLES]
+        views["exploration_noise"][...] = sim.exploration_noise[world]
+        self.header[seq] += 1  # even: complete
+
+        self.header[0] = slot
+
+    def read(self):
+        while True:
+            slot = self.header[0]
+            seq = 1 + slot
+            before = self.header[seq]
+            if before % 2:
+                continue
+            frame = {field: view.copy() for field, view in self.slots[slot].items()}
+            if self.header[seq] == before:
+                return frame
+
+    def close(self):
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+class SharedArray:
+    # a plain numpy array in shared memory, created by the owner and attached to by name
+    def __init__(self, shape, dtype, name=None):
+        nbytes = max(1, int(np.prod(shape)) * np.dtype(dtype).itemsize)
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=nbytes)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+        if self.owner:
+            self.array[...] = 0
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def close(self):
+        del self.array
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+
+def run_simulation(buffer_name, commands, stop, num_vehicles, num_worlds, model, width, height, seed,
+                   heatmap=None, compact=False, obstacles=None, occlusion=None, light_motion=None,
+                   pheromone=None, periodic=False):
+    # only world 0 of the ensemble is published to the viewer
+    sim = Simulation(num_vehicles, num_worlds, model, width, height, seed=seed, compact=compact,
+                     obstacles=obstacles, occlusion=occlusion, pheromone=pheromone, periodic=periodic)
+    print(sim.memory_report(), flush=True)
+    buffer = DoubleBuffer(sim.num_vehicles, sim.num_lights, name=buffer_name)
+    if light_motion is not None:
+        sim.add_stage(light_motion)
+
+    # the occupancy counts are written in place; the viewer only ever needs
+    # an approximately current copy, so they are not double-buffered
+    if heatmap is not None:
+        heatmap_name, cell = heatmap
+        counts = SharedArray(grid_shape(sim.width, sim.height, cell), np.uint32, name=heatmap_name)
+        sim.add_stage(OccupancyGrid(sim.width, sim.height, cell, counts=counts.array))
+    try:
+        while not stop.is_set():
+            try:
+                while True:
+                    sim.apply_command(commands.get_nowait())
+            except queue.Empty:
+                pass
+
+            sim.step()
+            buffer.write(sim)
+    finally:
+        if heatmap is not None:
+            sim.stages.clear()
+            counts.close()
+        buffer.close()
+
+
+class SimulationProcess:
+    def __init__(self, num_vehicles=1, num_worlds=1, model="vehicle5", width=None, height=None, seed=None,
+                 heatmap_cell=None, compact=False, obstacles=None, occlusion=None, light_motion=None, pheromone=None,
+                 periodic=False):
+        probe = Simulation(num_vehicles, 1, model, width, height, seed=seed, compact=compact, obstacles=obstacles)
+        self.world_size = (probe.width, probe.height)
+        self.buffer = DoubleBuffer(probe.num_vehicles, probe.num_lights)
+        self.buffer.write(probe)
+
+        self.heatmap = None
+        heatmap = None
+        if heatmap_cell is not None:
+            self.heatmap = SharedArray(grid_shape(probe.width, probe.height, heatmap_cell), np.uint32)
+            heatmap = (self.heatmap.name, heatmap_cell)
+
+        self.commands = multiprocessing.Queue()
+        self.stop = multiprocessing.Event()
+        self.process = multiprocessing.Process(
+            target=run_simulation,
+            args=(self.buffer.name, self.commands, self.stop, num_vehicles, num_worlds, model, width, height, seed,
+                  heatmap, compact, obstacles, occlusion, light_motion, pheromone, periodic),
+            daemon=True,
+        )
+
+    def start(self):
+        self.process.start()
+
+    def send(self, command):
+        self.commands.put(command)
+
+    def read(self):
+        return self.buffer.read()
+
+    def close(self):
+        self.stop.set()
+        self.process.join(timeout=1)
+        if self.process.is_alive():
+            self.process.terminate()
+        self.buffer.close()
+        if self.heatmap is not None:
+            self.heatmap.close()
@@ -0,0 +1,888 @@
+import copy
+
+import numpy as np
+
+from counter_rng import CounterNoise
+
+# Headless, batched version of the vehicle3_final.py, vehicle4_final.py and
+# vehicle5.py vehicles. The state lives in numpy arrays instead of Vehicle
+# objects so it can be stepped without a window (e.g. in its own process,
+# see shared_state.py and viewer.py).
+#
+# Every array has a leading ensemble axis: `num_worlds` independent worlds,
+# each with its own vehicles, lights, toggles and RNG stream, advance
+# together in one step() call. Shapes are (worlds, vehicles, ...) and
+# (worlds, lights, ...).
+#
+# The dual-sensor models (vehicle3, vehicle4) can also be integrated with an
+# adaptive step size (sim.adaptive = True): each world takes a step of dt
+# ticks, dt chosen from a Heun/Euler error estimate so that vehicles sub-step
+# near the inverse-distance singularity and stride through weak fields.
+# sim.step_dt is what each world's last step covered, in ticks, and what
+# the stages weight it by.
+#
+# With compact=True the per-vehicle state is float32 with small integer
+# counters (about 60 bytes a vehicle for vehicle5 instead of ~140), so a
+# million vehicles take about 60 MB. memory_report() lists what every array
+# costs; a memory_budget (bytes per vehicle) is checked at construction.
+#
+# With counter_noise=True the noise comes from a counter-based generator
+# (counter_rng.py) keyed by (world, vehicle, tick), so a vehicle's noise does
+# not depend on the ensemble size or on how the run is split up.
+
+EXPLORATION_NOISE = 0.3
+
+# adaptive step size, in ticks
+TOLERANCE = 0.5  # px of local error per step
+MIN_DT = 1e-3
+MAX_DT = 50.0
+
+# vehicle1_final.py turns its vehicles every 60 ms, about 7 ticks at 120 fps
+BROWNIAN_INTERVAL = 7
+
+# upper bound on the pre-drawn noise block, whatever the ensemble size
+NOISE_BLOCK_BYTES = 16 * 2**20
+
+# heading_table: sine table entries per degree, so the integer-degree
+# friction turns land exactly on entries
+HEADING_STEPS = 720
+
+# arrays that grow with the number of vehicles
+VEHICLE_STATE = [
+    "position",
+    "direction",
+    "left_sensor_position",
+    "right_sensor_position",
+    "exploration_timer",
+    "last_light_visit",
+    "speed",
+    "rotation",
+    "visiting",
+    "visited_light",
+]
+
+
+def inverse_distance(d):
+    # vehicle3_final.py
+    return 1 / d
+
+
+def sinusoid(d):
+    # vehicle4_final.py
+    x = (np.sin(d / 100) + 1) * 0.5
+    return np.maximum(0.1, x)
+
+
+def explorer_sinusoid(d):
+    # vehicle5.py
+    x = (np.sin(d / 80) + 1) * 0.5
+    return np.maximum(0.05, x * 0.8)
+
+
+def exploration_function(d, interest_level):
+    return explorer_sinusoid(d) + interest_level * 0.5
+
+
+def forward_vectors(direction):
+    # same as pygame.math.Vector2(0, -1).rotate(direction)
+    radians = np.radians(direction)
+    return np.stack((np.sin(radians), -np.cos(radians)), axis=-1)
+
+
+def sine_table(dtype=np.float64):
+    # (360 * HEADING_STEPS, 2) forward vectors, one row per table step
+    angles = np.radians(np.arange(360 * HEADING_STEPS) / HEADING_STEPS)
+    return np.stack((np.sin(angles), -np.cos(angles)), axis=-1).astype(dtype)
+
+
+def table_forward_vectors(direction, table):
+    # forward_vectors from the nearest table row, at most 1 / (2 * HEADING_STEPS)
+    # degree off and a gather instead of sin/cos
+    return np.take(table, np.rint(direction * HEADING_STEPS).astype(np.int64), axis=0, mode="wrap")
+
+
+def right_vectors(forward):
+    # same as forward.rotate(-90)
+    return np.stack((forward[..., 1], -forward[..., 0]), axis=-1)
+
+
+def reflected_directions(direction, normal):
+    # vehicle1_final.py: the heading reflected about a unit normal, as
+    # reflected.angle_to(up)
+    heading = forward_vectors(direction)
+    reflected = heading - 2 * (heading * normal).sum(axis=-1)[..., None] * normal
+    return -90 - np.degrees(np.arctan2(reflected[..., 1], reflected[..., 0]))
+
+
+def randint(u, low, high):
+    # random.randint(low, high) from a uniform sample in [0, 1)
+    return np.floor(u * (high - low + 1)) + low
+
+
+MODELS = {
+    # vehicle1_final.py: one sun, one sensor driving speed only, Brownian
+    # turns and collisions between vehicles
+    "vehicle1": dict(
+        width=600,
+        height=600,
+        lights=[(300, 300)],
+        light_radius=30,
+        radius=30,
+        sensor_radius=10,
+        sensor_spacing=0,
+        speed_scaling=50,
+        rotation_scaling=5,
+        friction=False,
+        cross=False,
+        start=None,
+        response=inverse_distance,
+        noise_slots=1,
+    ),
+    # vehicle2.py: vehicle3 with crossed wires and friction always on
+    "vehicle2": dict(
+        width=600,
+        height=600,
+        lights=[(300, 300)],
+        light_radius=30,
+        radius=30,
+        sensor_radius=10,
+        sensor_spacing=50,
+        speed_scaling=50,
+        rotation_scaling=5,
+        friction=True,
+        cross=True,
+        start=((300, 500), 55),
+        response=inverse_distance,
+        noise_slots=1,
+    ),
+    # vehicle3_final.py: one sun, dual sensors with inverse-distance response
+    "vehicle3": dict(
+        width=600,
+        height=600,
+        lights=[(300, 300)],
+        light_radius=30,
+        radius=30,
+        sensor_radius=10,
+        sensor_spacing=50,
+        speed_scaling=50,
+        rotation_scaling=5,
+        friction=False,
+        cross=False,
+        start=((300, 500), 55),
+        response=inverse_distance,
+        noise_slots=1,
+    ),
+    # vehicle4_final.py: one sun, dual sensors with sinusoid response
+    "vehicle4": dict(
+        width=600,
+        height=600,
+        lights=[(300, 300)],
+        light_radius=30,
+        radius=30,
+        sensor_radius=10,
+        sensor_spacing=50,
+        speed_scaling=2,
+        rotation_scaling=1,
+        friction=False,
+        cross=False,
+        start=((300, 500), 55),
+        response=sinusoid,
+        noise_slots=1,
+    ),
+    # vehicle5.py: four lights, explorer with noise and visit memory
+    "vehicle5": dict(
+        width=800,
+        height=800,
+        lights=[(150, 150), (650, 150), (150, 650), (650, 650)],
+        light_radius=25,
+        radius=20,
+        sensor_radius=8,
+        sensor_spacing=40,
+        speed_scaling=1.5,
+        rotation_scaling=0.8,
+        friction=True,
+        cross=False,
+        start=None,
+        response=None,
+        noise_slots=5,
+    ),
+}
+
+WIDTH, HEIGHT = MODELS["vehicle5"]["width"], MODELS["vehicle5"]["height"]
+
+
+def colliding_pairs(position, radius):
+    # Pairs of vehicles closer than 2 * radius within the same world, as flat
+    # indices into position.reshape(-1, 2). Vehicles are bucketed into cells
+    # of 2 * radius and only the own and four forward neighbour cells are
+    # searched, so the cost grows with the number of vehicles, not its square.
+    worlds, n, _ = position.shape
+    flat = position.reshape(-1, 2)
+    cells = np.floor(flat / (2 * radius)).astype(np.int64) + 1
+    world = np.repeat(np.arange(worlds), n)
+    span = cells.max(axis=0) + 2
+
+    def key(cx, cy):
+        return (world * span[0] + cx) * span[1] + cy
+
+    order = np.argsort(key(cells[:, 0], cells[:, 1]), kind="stable")
+    sorted_keys = key(cells[:, 0], cells[:, 1])[order]
+
+    pairs_i, pairs_j = [], []
+    for dx, dy in ((0, 0), (1, -1), (1, 0), (1, 1), (0, 1)):
+        target = key(cells[:, 0] + dx, cells[:, 1] + dy)
+        low = np.searchsorted(sorted_keys, target, "left")
+        counts = np.searchsorted(sorted_keys, target, "right") - low
+        i = np.repeat(np.arange(len(flat)), counts)
+        offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        j = order[np.repeat(low, counts) + offsets]
+        if (dx, dy) == (0, 0):
+            i, j = i[i < j], j[i < j]
+        pairs_i.append(i)
+        pairs_j.append(j)
+
+    i, j = np.concatenate(pairs_i), np.concatenate(pairs_j)
+    close = np.linalg.norm(flat[i] - flat[j], axis=-1) < 2 * radius
+    i, j = np.minimum(i[close], j[close]), np.maximum(i[close], j[close])
+    order = np.lexsort((j, i))
+    return i[order], j[order]
+
+
+class WorldNoise:
+    # One independent stream per world, spawned from a single seed so world w
+    # draws the same numbers whatever the ensemble size. Samples are drawn in
+    # blocks of ticks to keep the per-tick generator calls down; large
+    # ensembles get shorter blocks so a block stays under NOISE_BLOCK_BYTES.
+    def __init__(self, seed_sequences, num_vehicles, slots, block=64, dtype=np.float64):
+        self.generators = [np.random.default_rng(s) for s in seed_sequences]
+        self.num_vehicles = num_vehicles
+        self.slots = slots
+        self.dtype = dtype
+        tick_bytes = len(self.generators) * slots * num_vehicles * np.dtype(dtype).itemsize
+        self.block = int(np.clip(NOISE_BLOCK_BYTES // max(1, tick_bytes), 1, block))
+        self.samples = None
+        self.index = self.block
+
+    @property
+    def nbytes(self):
+        return self.block * self.slots * len(self.generators) * self.num_vehicles * np.dtype(self.dtype).itemsize
+
+    def next(self):
+        # uniforms in [0, 1) shaped (slots, worlds, vehicles)
+        if self.index == self.block:
+            self.samples = np.stack(
+                [g.random((self.block, self.slots, self.num_vehicles), dtype=self.dtype) for g in self.generators],
+                axis=2,
+            )
+            self.index = 0
+        sample = self.samples[self.index]
+        self.index += 1
+        return sample
+
+
+class Simulation:
+    def __init__(self, num_vehicles=1, num_worlds=1, model="vehicle5", width=None, height=None, seed=None,
+                 lights=None, compact=False, trail_length=0, memory_budget=None, obstacles=None, occlusion=None,
+                 pheromone=None, periodic=False, counter_noise=False, heading_table=False, light_index=None):
+        params = MODELS[model]
+        self.model = model
+        self.num_vehicles = num_vehicles
+        self.num_worlds = num_worlds
+        # custom light positions are in world coordinates and are not scaled
+        self.lights = lights
+        self.num_lights = len(lights if lights is not None else params["lights"])
+        self.width = width or params["width"]
+        self.height = height or params["height"]
+        self.seed = seed
+        # noise keyed by (world, vehicle, tick) (counter_rng.py) instead of a stream per world
+        self.counter_noise = counter_noise
+
+        self.radius = params["radius"]
+        self.light_radius = params["light_radius"]
+        self.speed_scaling = params["speed_scaling"]
+        self.rotation_scaling = params["rotation_scaling"]
+        self.sensor_radius = params["sensor_radius"]
+        self.sensor_offset = self.radius + self.sensor_radius
+        self.spacing = params["sensor_spacing"]
+        self.visit_threshold = 30
+        # sense lights at their nearest periodic image (positions wrap, so the
+        # arena is a torus); off by default, as in the scripts
+        self.periodic = periodic
+
+        # compact: float32 kinematics, uint8 timers and int16 light indices
+        # (int32 with more lights than int16 can number)
+        self.compact = compact
+        self.float = np.float32 if compact else np.float64
+        self.counter = np.uint8 if compact else np.int64
+        self.index = np.int64
+        if compact:
+            self.index = np.int16 if self.num_lights <= np.iinfo(np.int16).max else np.int32
+        # headings from a sine table (table_forward_vectors) instead of sin/cos
+        self.heading_table = sine_table(self.float) if heading_table else None
+        # positions of the last trail_length ticks, kept only if asked for
+        self.trail_length = trail_length
+        self.memory_budget = memory_budget  # bytes per vehicle
+
+        # per-world toggles
+        self.mono = np.zeros(num_worlds, dtype=bool)
+        self.friction = np.full(num_worlds, params["friction"])
+        self.inhibition = np.zeros(num_worlds, dtype=bool)
+        self.cross = np.full(num_worlds, params["cross"])
+        self.exploration_noise = np.full(num_worlds, EXPLORATION_NOISE, dtype=self.float)
+
+        self.response = params["response"]
+        self.adaptive = False
+        self.tolerance = TOLERANCE
+        self.min_dt = MIN_DT
+        self.max_dt = MAX_DT
+
+        # static walls (obstacles.Obstacles), resolved after every step
+        self.obstacles = obstacles
+        # lines of sight between sensors and lights (occlusion.Occlusion); None: lights shine through everything
+        self.occlusion = occlusion
+        # a field the vehicles deposit into and sense (pheromone.PheromoneField)
+        self.pheromone = pheromone
+        # a spatial index of the lights for visit detection (light_index.LightIndex); None: scan every light
+        self.light_index = light_index
+
+        # callables (sim, worlds, vehicles, lights) told about the visits of every tick, in one batch
+        self.visit_subscribers = []
+        # objects with update(sim) (and optionally reset(sim)) run after every step
+        self.stages = []
+
+        self.reset()
+
+        if memory_budget is not None and self.bytes_per_vehicle() > memory_budget:
+            raise MemoryError(
+                f"{self.bytes_per_vehicle():.0f} bytes per vehicle over the budget of {memory_budget}\n"
+                + self.memory_report()
+            )
+
+    def reset(self):
+        params = MODELS[self.model]
+        w, n, l = self.num_worlds, self.num_vehicles, self.num_lights
+        self.tick = 0
+
+        # simulated time in ticks and the next adaptive step size, per world
+        self.time = np.zeros(w)
+        self.dt = np.ones(w)
+        self.time_limit = None
+        # simulated ticks covered by the last step (0 where it was rejected),
+        # the weight of that step for everything that accumulates per tick
+        self.step_dt = np.ones(w)
+
+        streams = [s.spawn(2) for s in np.random.SeedSequence(self.seed).spawn(w)]
+        setup = [np.random.default_rng(init) for init, _ in streams]
+        if self.counter_noise:
+            self.noise = CounterNoise(self.seed, w, n, params["noise_slots"], dtype=self.float)
+        else:
+            self.noise = WorldNoise([noise for _, noise in streams], n, params["noise_slots"], dtype=self.float)
+
+        # the model layouts are given for their default arena; larger arenas scale them
+        scale = np.array([self.width / params["width"], self.height / params["height"]])
+        if self.lights is not None:
+            lights = np.array(self.lights, dtype=float).reshape(l, 2)
+        else:
+            lights = np.array(params["lights"], dtype=float) * scale
+        self.light_position = np.broadcast_to(lights, (w, l, 2)).astype(self.float)
+        self.light_intensity = np.ones((w, l), dtype=self.float)
+        self.visited_count = np.zeros((w, l), dtype=np.int64)
+
+        self.position = np.empty((w, n, 2), dtype=self.float)
+        self.direction = np.empty((w, n), dtype=self.float)
+        for world, rng in enumerate(setup):
+            if self.model == "vehicle5":
+                self.light_intensity[world] = rng.uniform(0.7, 1.0, l)
+
+            if params["start"] is not None and n == 1:
+                start, self.direction[world] = params["start"]
+                self.position[world] = start * scale
+            elif n == 1:
+                self.position[world] = (self.width // 2, self.height // 2)
+                self.direction[world] = rng.integers(0, 361, n)
+            else:
+                self.position[world] = rng.uniform((0, 0), (self.width, self.height), (n, 2))
+                self.direction[world] = rng.integers(0, 361, n)
+
+        self.exploration_timer = np.zeros((w, n), dtype=self.counter)
+        self.last_light_visit = np.full((w, n), -1, dtype=self.index)
+
+        # what happened in the last step, for the stages
+        self.speed = np.zeros((w, n), dtype=self.float)
+        self.rotation = np.zeros((w, n), dtype=self.float)
+        self.visiting = np.zeros((w, n), dtype=bool)
+        self.visited_light = np.full((w, n), -1, dtype=self.index)
+
+        self.trail = None
+        if self.trail_length:
+            self.trail = np.zeros((self.trail_length, w, n, 2), dtype=self.float)
+
+        self.left_sensor_position = np.empty((w, n, 2), dtype=self.float)
+        self.right_sensor_position = np.empty((w, n, 2), dtype=self.float)
+        self.reset_sensor_positions()
+        if self.obstacles is not None:
+            self.obstacles.collide(self)
+        if self.occlusion is not None:
+            self.occlusion.reset(self)
+        if self.pheromone is not None:
+            self.pheromone.reset(self)
+        if self.light_index is not None:
+            self.light_index.reset(self)
+
+        for stage in self.stages:
+            if hasattr(stage, "reset"):
+                stage.reset(self)
+
+    @property
+    def sensor_spacing(self):
+        return np.where(self.mono, 0, self.spacing)
+
+    def reset_sensor_positions(self):
+        if self.model in ("vehicle2", "vehicle3", "vehicle4"):
+            # the dual-sensor scripts start with sensors that ignore the heading
+            spacing = self.sensor_spacing[:, None, None]
+            ahead = self.position + (0, -self.sensor_offset)
+            self.left_sensor_position[:] = ahead + (1, 0) - spacing * (0, 1)
+            self.right_sensor_position[:] = ahead + (1, 0) + spacing * (0, 1)
+        else:
+            self.update_sensor_positions(self.headings(self.direction))
+
+    def headings(self, direction):
+        # unit forward vectors of headings in degrees
+        if self.heading_table is None:
+            return forward_vectors(direction)
+        return table_forward_vectors(direction, self.heading_table)
+
+    def update_sensor_positions(self, forward, worlds=slice(None)):
+        right = right_vectors(forward)
+        half_spacing = self.sensor_spacing[worlds, None, None] / 2
+
+        ahead = self.position[worlds] + forward * self.sensor_offset
+        self.left_sensor_position[worlds] = ahead - right * half_spacing
+        self.right_sensor_position[worlds] = ahead + right * half_spacing
+
+    def light_distances(self, points):
+        # (worlds, vehicles, lights)
+        delta = points[:, :, None, :] - self.light_position[:, None, :, :]
+        if self.periodic:
+            self.minimum_image(delta)
+        return np.linalg.norm(delta, axis=-1)
+
+    def minimum_image(self, delta):
+        # in place: only |dx| and |dy| matter, and the nearer of the light and
+        # its copy one arena away is min(|d|, size - |d|) (good for |d| < 1.5
+        # arenas, sensors stick out of the arena by a body)
+        np.abs(delta, out=delta)
+        np.minimum(delta, np.array([self.width, self.height], dtype=delta.dtype) - delta, out=delta)
+        return delta
+
+    def light_visibility(self, points):
+        # (worlds, vehicles, lights), or 1 when nothing occludes
+        if self.occlusion is None:
+            return 1
+        return self.occlusion.visibility(self, points)
+
+    def sensor_response(self, points):
+        intensity = self.light_intensity[:, None, :]
+        return self.response(self.light_distances(points)) * intensity * self.light_visibility(points)
+
+    def pheromone_stimulus(self, points):
+        # (worlds, vehicles), or 0 without a pheromone field
+        if self.pheromone is None:
+            return 0
+        return self.pheromone.sense(self, points)
+
+    def wrap_positions(self):
+        self.position[..., 0] %= self.width
+        self.position[..., 1] %= self.height
+
+    def step(self):
+        self.step_dt[:] = 1
+        if self.model == "vehicle5":
+            self.step_vehicle5()
+            self.time += 1
+        elif self.model == "vehicle1":
+            self.step_vehicle1()
+            self.time += 1
+        elif self.adaptive:
+            self.step_adaptive()
+        else:
+            self.step_dual_sensor()
+            self.time += 1
+        self.end_step()
+
+    def end_step(self):
+        if self.obstacles is not None:
+            self.obstacles.collide(self)
+        if self.pheromone is not None:
+            self.pheromone.update(self)
+        if self.trail is not None:
+            self.trail[self.tick % self.trail_length] = self.position
+        # headings are kept modulo 360, where float32 still resolves them finely
+        np.mod(self.direction, 360, out=self.direction)
+        self.tick += 1
+
+        for stage in self.stages:
+            stage.update(self)
+
+    def recent_positions(self):
+        # the trail, oldest first: (ticks, worlds, vehicles, 2)
+        count = min(self.tick, self.trail_length)
+        return self.trail[np.arange(self.tick - count, self.tick) % self.trail_length]
+
+    def state_bytes(self):
+        arrays = {name: getattr(self, name).nbytes for name in VEHICLE_STATE}
+        if self.trail is not None:
+            arrays["trail"] = self.trail.nbytes
+        arrays["noise"] = self.noise.nbytes
+        # stages that keep per-vehicle state report it as nbytes
+        for stage in self.stages:
+            if hasattr(stage, "nbytes"):
+                name = type(stage).__name__
+                arrays[name] = arrays.get(name, 0) + stage.nbytes
+        return arrays
+
+    def bytes_per_vehicle(self):
+        return sum(self.state_bytes().values()) / (self.num_worlds * self.num_vehicles)
+
+    def memory_report(self):
+        vehicles = self.num_worlds * self.num_vehicles
+        state = self.state_bytes()
+        lines = [
+            f"{self.model}: {self.num_worlds} x {self.num_vehicles} vehicles, "
+            f"{np.dtype(self.float).name} state"
+        ]
+        for name, nbytes in state.items():
+            lines.append(f"  {name:22s} {nbytes / vehicles:6.1f} B/vehicle {nbytes / 2**20:9.1f} MB")
+        total = sum(state.values())
+        budget = f" (budget {self.memory_budget} B/vehicle)" if self.memory_budget else ""
+        lines.append(f"  {'total':22s} {total / vehicles:6.1f} B/vehicle {total / 2**20:9.1f} MB{budget}")
+        return "\n".join(lines)
+
+    def subscribe_visits(self, subscriber):
+        self.visit_subscribers.append(subscriber)
+        return subscriber
+
+    def add_stage(self, stage):
+        self.stages.append(stage)
+        if hasattr(stage, "reset"):
+            stage.reset(self)
+        return stage
+
+    def advance(self, duration):
+        # step until every world has simulated `duration` more ticks
+        target = self.time.max() + duration
+        self.time_limit = target
+        steps = 0
+        while (self.time < target).any():
+            self.step()
+            steps += 1
+        self.time_limit = None
+        return steps
+
+    def dual_sensor_stimulus(self):
+        left_stimulus = self.sensor_response(self.left_sensor_position).sum(axis=-1)
+        left_stimulus += self.pheromone_stimulus(self.left_sensor_position)
+        right_stimulus = self.sensor_response(self.right_sensor_position).sum(axis=-1)
+        right_stimulus += self.pheromone_stimulus(self.right_sensor_position)
+        return left_stimulus, right_stimulus
+
+    def step_dual_sensor(self):
+        (friction_noise,) = self.noise.next()
+
+        forward = self.headings(self.direction)
+
+        left_stimulus, right_stimulus = self.dual_sensor_stimulus()
+        left_speed, right_speed = self.speed_scaling * left_stimulus, self.speed_scaling * right_stimulus
+
+        speed = (left_speed + right_speed) / 2
+        speed = np.where(self.inhibition[:, None], 1 - speed, speed)
+
+        rotation = (right_speed - left_speed) * self.rotation_scaling
+        rotation = np.where(self.cross[:, None], -rotation, rotation)
+
+        self.direction += rotation
+        self.position += self.headings(self.direction) * speed[..., None]
+        self.wrap_positions()
+        self.speed[:], self.rotation[:] = speed, rotation
+
+        # the scripts place the sensors with the heading from before the turn
+        self.update_sensor_positions(forward)
+
+        self.direction += np.where(self.friction[:, None], randint(friction_noise, -5, 5), 0)
+
+    def derivatives(self, position, direction):
+        # rates of change per tick of the dual-sensor vehicles, with the
+        # sensors placed from the given state
+        forward = self.headings(direction)
+        right = right_vectors(forward)
+        half_spacing = self.sensor_spacing[:, None, None] / 2
+        ahead = position + forward * self.sensor_offset
+
+        left_sensor, right_sensor = ahead - right * half_spacing, ahead + right * half_spacing
+        left_stimulus = self.sensor_response(left_sensor).sum(axis=-1) + self.pheromone_stimulus(left_sensor)
+        right_stimulus = self.sensor_response(right_sensor).sum(axis=-1) + self.pheromone_stimulus(right_sensor)
+        left_speed, right_speed = self.speed_scaling * left_stimulus, self.speed_scaling * right_stimulus
+
+        speed = (left_speed + right_speed) / 2
+        speed = np.where(self.inhibition[:, None], 1 - speed, speed)
+
+        rotation = (right_speed - left_speed) * self.rotation_scaling
+        rotation = np.where(self.cross[:, None], -rotation, rotation)
+
+        return forward * speed[..., None], rotation, speed
+
+    def step_adaptive(self):
+        (friction_noise,) = self.noise.next()
+
+        # worlds that have reached advance()'s limit sit the step out, the
+        # others stop exactly on it
+        dt = self.dt
+        active = np.ones(self.num_worlds, dtype=bool)
+        last = np.zeros(self.num_worlds, dtype=bool)
+        if self.time_limit is not None:
+            active = self.time < self.time_limit
+            last = active & (dt >= self.time_limit - self.time)
+            dt = np.where(active, np.minimum(dt, self.time_limit - self.time), 0)
+        h = dt[:, None]
+
+        # Heun step with the embedded Euler step as error estimate
+        velocity1, rotation1, speed = self.derivatives(self.position, self.direction)
+        velocity2, rotation2, _ = self.derivatives(
+            self.position + h[..., None] * velocity1, self.direction + h * rotation1
+        )
+        position = self.position + h[..., None] * (velocity1 + velocity2) / 2
+        direction = self.direction + h * (rotation1 + rotation2) / 2
+
+        # heading error counts as the displacement it causes at the sensors
+        position_error = np.linalg.norm(velocity2 - velocity1, axis=-1) * h / 2
+        heading_error = np.radians(np.abs(rotation2 - rotation1)) * h / 2 * self.sensor_offset
+        error = np.maximum(position_error, heading_error).max(axis=-1)
+        error = np.where(np.isfinite(error), error, np.inf)
+
+        # a step already at min_dt is taken regardless, so time always advances
+        accepted = ((error <= self.tolerance) | (dt <= self.min_dt)) & active
+        self.position[accepted] = position[accepted]
+        self.direction[accepted] = direction[accepted]
+        self.wrap_positions()
+        self.time[accepted] += dt[accepted]
+        self.time[accepted & last] = self.time_limit
+        self.step_dt[:] = np.where(accepted, dt, 0)
+
+        # standard controller, bounded growth/shrink per step
+        factor = np.clip(0.9 * np.sqrt(self.tolerance / np.maximum(error, 1e-12)), 0.2, 5.0)
+        self.dt = np.where(active, np.clip(dt * factor, self.min_dt, self.max_dt), self.dt)
+
+        self.update_sensor_positions(self.headings(self.direction))
+
+        # the per-tick heading kicks of FRICTION become a random walk in time
+        kick = randint(friction_noise, -5, 5) * np.sqrt(h)
+        self.direction += np.where(self.friction[:, None] & accepted[:, None], kick, 0)
+
+        self.speed[:], self.rotation[:] = speed, (rotation1 + rotation2) / 2
+
+    def step_vehicle1(self):
+        (brownian,) = self.noise.next()
+
+        if self.tick % BROWNIAN_INTERVAL == BROWNIAN_INTERVAL - 1:
+            self.direction += randint(brownian, -1, 1)
+
+        self.collide()
+
+        forward = self.headings(self.direction)
+        sensor_position = self.left_sensor_position  # single sensor: no spacing
+        stimulus = self.sensor_response(sensor_position).sum(axis=-1) + self.pheromone_stimulus(sensor_position)
+        speed = self.speed_scaling * stimulus
+
+        self.position += forward * speed[..., None]
+        self.wrap_positions()
+        self.update_sensor_positions(forward)
+        self.speed[:], self.rotation[:] = speed, 0
+
+    def collide(self):
+        # vehicle1_final.py: reflect the headings of touching vehicles about
+        # the line between their centres. All pairs use the headings from the
+        # start of the tick (the script updates them pair by pair).
+        i, j = colliding_pairs(self.position, self.radius)
+        if not len(i):
+            return
+        position = self.position.reshape(-1, 2)
+        direction = self.direction.reshape(-1)
+
+        collision_vector = position[j] - position[i]
+        length = np.linalg.norm(collision_vector, axis=-1)
+        keep = length > 0
+        i, j = i[keep], j[keep]
+        collision_vector = collision_vector[keep] / length[keep, None]
+
+        direction[i], direction[j] = (
+            reflected_directions(direction[i], collision_vector), reflected_directions(direction[j], collision_vector)
+        )
+
+    def calculate_combined_stimulus(self):
+        left_dist = self.light_distances(self.left_sensor_position)
+        right_dist = self.light_distances(self.right_sensor_position)
+
+        interest_level = np.maximum(0.1, 1.0 - self.visited_count * 0.1).astype(self.float)[:, None, :]
+        intensity = self.light_intensity[:, None, :]
+        left_intensity = intensity * self.light_visibility(self.left_sensor_position)
+        right_intensity = intensity * self.light_visibility(self.right_sensor_position)
+        left_total = (exploration_function(left_dist, interest_level) * left_intensity).sum(axis=-1)
+        right_total = (exploration_function(right_dist, interest_level) * right_intensity).sum(axis=-1)
+        left_total += self.pheromone_stimulus(self.left_sensor_position)
+        right_total += self.pheromone_stimulus(self.right_sensor_position)
+
+        # visit detection against the closest light (with a light index, the
+        # closest within visit_threshold * 2, or -1 at an infinite distance)
+        if self.light_index is None:
+            center_dist = self.light_distances(self.position)
+            closest = np.argmin(center_dist, axis=-1)
+            min_distance = np.take_along_axis(center_dist, closest[..., None], axis=-1)[..., 0]
+        else:
+            closest, min_distance = self.light_index.nearest(self, self.position)
+
+        visiting = (min_distance < self.visit_threshold) & (self.last_light_visit != closest)
+        worlds = np.broadcast_to(np.arange(self.num_worlds)[:, None], closest.shape)
+        np.add.at(self.visited_count, (worlds[visiting], closest[visiting]), 1)
+        self.last_light_visit[visiting] = closest[visiting]
+        self.last_light_visit[min_distance > self.visit_threshold * 2] = -1
+        self.visiting[:], self.visited_light[:] = visiting, closest
+        if self.visit_subscribers and visiting.any():
+            worlds, vehicles = np.nonzero(visiting)
+            lights = closest[worlds, vehicles]
+            for subscriber in self.visit_subscribers:
+                subscriber(self, worlds, vehicles, lights)
+
+        return left_total, right_total
+
+    def step_vehicle5(self):
+        noise, explore_roll, boost_roll, side_roll, friction_noise = self.noise.next()
+        left_stimulus, right_stimulus = self.calculate_combined_stimulus()
+
+        exploration_noise = self.exploration_noise[:, None]
+        exploration_noise = -exploration_noise + 2 * exploration_noise * noise
+
+        left_speed = self.speed_scaling * left_stimulus
+        right_speed = self.speed_scaling * right_stimulus
+
+        # occasional random boost of one wheel, once per 61 ticks
+        self.exploration_timer += 1
+        due = self.exploration_timer > 60
+        explore = due & (explore_roll < 0.3)
+        boost = 0.5 + boost_roll
+        boost_left = side_roll < 0.5
+        left_speed = np.where(explore & boost_left, left_speed * boost, left_speed)
+        right_speed = np.where(explore & ~boost_left, right_speed * boost, right_speed)
+        self.exploration_timer[due] = 0
+
+        speed = (left_speed + right_speed) / 2
+        speed = np.where(self.inhibition[:, None], np.maximum(0.1, 1 - speed), speed)
+
+        rotation = (right_speed - left_speed) * self.rotation_scaling
+        rotation = np.where(self.cross[:, None], -rotation, rotation)
+
+        rotation += exploration_noise
+
+        self.direction += rotation
+        forward = self.headings(self.direction)
+        self.position += forward * speed[..., None]
+        self.wrap_positions()
+        self.speed[:], self.rotation[:] = speed, rotation
+
+        self.update_sensor_positions(forward)
+
+        self.direction += np.where(self.friction[:, None], -2 + 4 * friction_noise, 0)
+
+    def drive(self, left_speed, right_speed):
+        # one tick with the wheel speeds (worlds, vehicles) given from outside
+        # (vec_env.py) instead of wired to the sensors; friction still applies
+        friction_noise = self.noise.next()[-1]
+
+        speed = (left_speed + right_speed) / 2
+        rotation = (right_speed - left_speed) * self.rotation_scaling
+
+        self.direction += rotation
+        forward = self.headings(self.direction)
+        self.position += forward * speed[..., None]
+        self.wrap_positions()
+        self.speed[:], self.rotation[:] = speed, rotation
+        self.update_sensor_positions(forward)
+
+        if self.model == "vehicle5":
+            friction = -2 + 4 * friction_noise
+        else:
+            friction = randint(friction_noise, -5, 5)
+        self.direction += np.where(self.friction[:, None], friction, 0)
+        self.time += 1
+        self.step_dt[:] = 1
+        self.end_step()
+
+    def apply_command(self, command, world=None):
+        worlds = slice(None) if world is None else world
+        if command == "mono":
+            self.mono[worlds] = ~self.mono[worlds]
+        elif command == "friction":
+            self.friction[worlds] = ~self.friction[worlds]
+        elif command == "inhibition":
+            self.inhibition[worlds] = ~self.inhibition[worlds]
+        elif command == "cross":
+            self.cross[worlds] = ~self.cross[worlds]
+        elif command == "reset":
+            self.reset()
+        elif command == "noise_up":
+            self.exploration_noise[worlds] = np.minimum(1.0, self.exploration_noise[worlds] + 0.1)
+        elif command == "noise_down":
+            self.exploration_noise[worlds] = np.maximum(0.0, self.exploration_noise[worlds] - 0.1)
+
+
+class Ecology:
+    # Mixed populations in one set of worlds: one Simulation group per
+    # vehicle type, each stepped by its own batched kernel, all sharing the
+    # same lights (and so the same visit counts).
+    def __init__(self, populations, num_worlds=1, width=WIDTH, height=HEIGHT, lights=None, seed=None,
+                 compact=False, obstacles=None, occlusion=None, pheromone=None, periodic=False, counter_noise=False,
+                 heading_table=False, light_index=None):
+        if lights is None:
+            lights = MODELS["vehicle5"]["lights"]
+            lights = np.array(lights) * (width / MODELS["vehicle5"]["width"], height / MODELS["vehicle5"]["height"])
+        self.groups = {
+            model: Simulation(
+                count, num_worlds, model, width, height, seed=None if seed is None else [seed, index], lights=lights,
+                compact=compact, obstacles=obstacles,
+                # each group blocks light with its own bodies and lays its own pheromone
+                occlusion=copy.copy(occlusion), pheromone=copy.copy(pheromone), periodic=periodic,
+                counter_noise=counter_noise, heading_table=heading_table, light_index=copy.copy(light_index),
+            )
+            for index, (model, count) in enumerate(populations.items())
+        }
+        self.num_worlds = num_worlds
+        self.width = width
+        self.height = height
+        self.share_lights()
+
+    def share_lights(self):
+        first = next(iter(self.groups.values()))
+        for group in self.groups.values():
+            group.light_position = first.light_position
+            group.light_intensity = first.light_intensity
+            group.visited_count = first.visited_count
+
+    @property
+    def tick(self):
+        return next(iter(self.groups.values())).tick
+
+    def step(self):
+        for group in self.groups.values():
+            group.step()
+
+    def reset(self):
+        for group in self.groups.values():
+            group.reset()
+        self.share_lights()
+
+    def apply_command(self, command, world=None):
+        if command == "reset":
+            self.reset()
+            return
+        for group in self.groups.values():
+            group.apply_command(command, world)
@@ -0,0 +1,162 @@
+import numpy as np
+
+from simulation import MODELS, Simulation
+
+# Gym-style vectorised environment for training controllers in place of the
+# hard-wired sensor-motor coupling of vehicle2-5.
+#
+# Every environment is a world of simulation.Simulation with one vehicle,
+# and all of them advance in one batched step. An action is the pair of
+# wheel speeds (left, right) of every environment; the observation is what
+# the two sensors read (left, right stimulus, as the model's own wiring
+# would see it). Noise is counter-based (counter_rng.py), so an
+# environment's noise does not depend on how many run alongside it.
+#
+# With image_size set the observation is a dict that also holds a
+# low-resolution top-down view of every arena (lights, vehicle body and
+# sensors as grey levels), drawn into a preallocated off-screen buffer and
+# handed out as a copy, so the caller's frames survive the next step.
+#
+# Episodes are truncated after max_ticks, and truncated environments are
+# reset in the same step (their last observation is in
+# info["final_observation"], for the environments in info["final_envs"]).
+#
+#   env = VehicleEnv(4096, "vehicle4", seed=0)
+#   observation, info = env.reset()
+#   observation, reward, terminated, truncated, info = env.step(actions)  # actions (4096, 2)
+
+MAX_TICKS = 1000
+LIGHT_LEVEL = 255
+BODY_LEVEL = 96
+SENSOR_LEVEL = 160
+
+
+def light_reward(env, observation):
+    # the mean stimulus of the two sensors: seek the light
+    return observation.mean(axis=-1)
+
+
+def disc_offsets(radius):
+    # pixel offsets covered by a disc of `radius` pixels (at least the centre)
+    extent = int(radius)
+    ox, oy = np.mgrid[-extent:extent + 1, -extent:extent + 1]
+    inside = np.hypot(ox, oy) <= max(radius, 0.5)
+    return np.stack((ox[inside], oy[inside]), axis=-1)
+
+
+class VehicleEnv:
+    def __init__(self, num_envs, model="vehicle4", seed=None, max_ticks=MAX_TICKS, image_size=None,
+                 reward=light_reward, **options):
+        if MODELS[model]["sensor_spacing"] == 0:
+            raise ValueError(f"{model} has a single sensor")
+        self.num_envs = num_envs
+        self.model = model
+        self.seed = seed
+        self.max_ticks = max_ticks
+        self.image_size = image_size
+        self.reward = reward
+        self.options = options
+        self.observation_shape = (2,)
+        self.action_shape = (2,)
+        self.sim = None
+
+    def reset(self, seed=None):
+        # the worlds are built on the first reset and when reseeded
+        if self.sim is None or seed is not None:
+            self.seed = self.seed if seed is None else seed
+            self.sim = Simulation(1, self.num_envs, self.model, seed=self.seed, counter_noise=True, **self.options)
+            self.rng = np.random.default_rng(np.random.SeedSequence(self.seed).spawn(1)[0])
+            self.episode_ticks = np.zeros(self.num_envs, dtype=np.int64)
+            if self.image_size:
+                self.image = np.zeros((self.num_envs, self.image_size, self.image_size), dtype=np.uint8)
+                self.drawn_lights = None
+        self.reset_envs(np.arange(self.num_envs))
+        return self.observe(), {}
+
+    def reset_envs(self, envs):
+        # new episodes for the given environments: random position and heading
+        sim = self.sim
+        sim.position[envs, 0] = self.rng.uniform((0, 0), (sim.width, sim.height), (len(envs), 2))
+        sim.direction[envs, 0] = self.rng.uniform(0, 360, len(envs))
+        sim.update_sensor_positions(sim.headings(sim.direction[envs]), envs)
+        sim.exploration_timer[envs] = 0
+        sim.last_light_visit[envs] = -1
+        sim.visited_count[envs] = 0
+        sim.time[envs] = 0
+        self.episode_ticks[envs] = 0
+
+    def sense(self):
+        # (envs, 2) left and right stimulus; vehicle5 also detects its visits
+        sim = self.sim
+        if sim.model == "vehicle5":
+            left, right = sim.calculate_combined_stimulus()
+        else:
+            left, right = sim.dual_sensor_stimulus()
+        return np.stack((left[:, 0], right[:, 0]), axis=-1)
+
+    def observe(self):
+        sensors = self.sense()
+        if not self.image_size:
+            return sensors
+        return {"sensors": sensors, "image": self.render().copy()}
+
+    def render(self):
+        # (envs, size, size) uint8, rows along y
+        sim, size = self.sim, self.image_size
+        scale = np.array([size / sim.width, size / sim.height])
+        if self.drawn_lights is None or not np.array_equal(self.drawn_lights, sim.light_position):
+            self.draw_lights(scale)
+        image = self.image
+        np.copyto(image, self.background)
+        envs = np.arange(self.num_envs)[:, None]
+        for points, level, offsets in (
+            (sim.position, BODY_LEVEL, self.body),
+            (sim.left_sensor_position, SENSOR_LEVEL, self.sensor),
+            (sim.right_sensor_position, SENSOR_LEVEL, self.sensor),
+        ):
+            pixel = np.floor(points[:, 0] * scale).astype(np.int64)
+            x = np.clip(pixel[:, None, 0] + offsets[:, 0], 0, size - 1)
+            y = np.clip(pixel[:, None, 1] + offsets[:, 1], 0, size - 1)
+            image[envs, y, x] = level
+        return image
+
+    def draw_lights(self, scale):
+        sim, size = self.sim, self.image_size
+        pixels = scale.min()
+        self.body = disc_offsets(sim.radius * pixels)
+        self.sensor = disc_offsets(sim.sensor_radius * pixels)
+        light = disc_offsets(sim.light_radius * pixels)
+
+        self.background = np.zeros_like(self.image)
+        level = (LIGHT_LEVEL * sim.light_intensity).astype(np.uint8)
+        envs = np.arange(self.num_envs)[:, None]
+        for index in range(sim.num_lights):
+            pixel = np.floor(sim.light_position[:, index] * scale).astype(np.int64)
+            x = np.clip(pixel[:, None, 0] + light[:, 0], 0, size - 1)
+            y = np.clip(pixel[:, None, 1] + light[:, 1], 0, size - 1)
+            self.background[envs, y, x] = level[:, index, None]
+        self.drawn_lights = sim.light_position.copy()
+
+    def step(self, actions):
+        sim = self.sim
+        actions = np.asarray(actions, dtype=sim.float).reshape(self.num_envs, 2)
+        sim.drive(actions[:, :1], actions[:, 1:])
+        self.episode_ticks += 1
+
+        observation = self.observe()
+        sensors = observation["sensors"] if self.image_size else observation
+        reward = self.reward(self, sensors)
+        terminated = np.zeros(self.num_envs, dtype=bool)
+        truncated = self.episode_ticks >= self.max_ticks
+
+        info = {}
+        if truncated.any():
+            envs = np.flatnonzero(truncated)
+            if self.image_size:
+                info["final_observation"] = {"sensors": sensors[envs], "image": observation["image"][envs]}
+            else:
+                info["final_observation"] = sensors[envs]
+            info["final_envs"] = envs
+            self.reset_envs(envs)
+            observation = self.observe()
+        return observation, reward, terminated, truncated, info
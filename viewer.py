@@ -0,0 +1,302 @@
+import numpy as np
+import pygame
+
+from camera import Camera
+from heatmap import HEATMAP_CELL, OccupancyGrid
+from lights import LightMotion
+from obstacles import Obstacles, maze_walls
+from occlusion import Occlusion
+from pheromone import PheromoneField
+from renderer import HeatmapOverlay, VehicleRenderer
+from shared_state import SimulationProcess, TOGGLES
+from simulation import MODELS, Simulation
+
+# Viewer for the headless vehicles in simulation.py.
+#
+# With SEPARATE_PROCESS the simulation runs in its own process and writes
+# into a double-buffered shared-memory block; this loop only draws the
+# latest complete state and forwards key presses as commands, so drawing
+# and stepping each run at their own rate.
+#
+# The window is a pan/zoom camera onto the world (see camera.py), so the
+# arena can be far larger than the screen; only what intersects the
+# viewport is drawn, at a level of detail chosen by renderer.py (L cycles
+# auto/full/sprite/pixel). H toggles the occupancy heatmap (heatmap.py).
+# With MAZE_SPACING set the arena is a maze of walls (obstacles.py), which
+# cast shadows with OCCLUSION (occlusion.py). LIGHT_MOTION makes the lights
+# drift and pulse (lights.py). With PHEROMONE the vehicles also follow the
+# trail field they lay (pheromone.py). PERIODIC makes the sensors see the
+# lights across the wrapping edges.
+
+SEPARATE_PROCESS = True
+MODEL = "vehicle5"  # or "vehicle3", "vehicle4"
+NUM_VEHICLES = 1
+NUM_WORLDS = 1  # only world 0 is drawn
+WORLD_WIDTH, WORLD_HEIGHT = None, None  # None: the model's own arena size
+COMPACT = False  # float32 state, for very large swarms
+MAZE_SPACING = None  # e.g. 200: a maze with corridors this wide
+OCCLUSION = False  # walls block the light
+LIGHT_MOTION = None  # e.g. dict(drift=0.5, pulse_depth=0.6)
+PHEROMONE = None  # e.g. dict(gain=0.05, every=4)
+PERIODIC = False  # sense the nearest periodic image of every light
+
+VIEW_WIDTH, VIEW_HEIGHT = 800, 800
+PAN_SPEED = 10  # screen pixels per frame
+ZOOM_STEP = 1.1
+
+fps = 120
+
+WHITE = (255, 255, 255)
+YELLOW = (255, 255, 0)
+RED = (255, 0, 0)
+ORANGE = (255, 165, 0)
+
+GREY = (140, 140, 160)
+
+LIGHT_COLORS = [YELLOW, ORANGE, (255, 200, 100), (255, 255, 150)]
+TRAIL_LENGTH = 20
+
+KEY_COMMANDS = {
+    pygame.K_m: "mono",
+    pygame.K_r: "friction",
+    pygame.K_i: "inhibition",
+    pygame.K_c: "cross",
+    pygame.K_SPACE: "reset",
+    pygame.K_UP: "noise_up",
+    pygame.K_DOWN: "noise_down",
+}
+
+PAN_KEYS = {
+    pygame.K_a: (-1, 0),
+    pygame.K_d: (1, 0),
+    pygame.K_w: (0, -1),
+    pygame.K_s: (0, 1),
+}
+
+
+def local_frame(sim, world=0):
+    return {
+        "tick": sim.tick,
+        "position": sim.position[world],
+        "direction": sim.direction[world],
+        "left_sensor_position": sim.left_sensor_position[world],
+        "right_sensor_position": sim.right_sensor_position[world],
+        "light_position": sim.light_position[world],
+        "light_intensity": sim.light_intensity[world],
+        "visited_count": sim.visited_count[world],
+        "toggles": [getattr(sim, toggle)[world] for toggle in TOGGLES],
+        "exploration_noise": sim.exploration_noise[world],
+    }
+
+
+class Trails:
+    # ring buffer of the last TRAIL_LENGTH positions of every vehicle
+    def __init__(self, num_vehicles, length=TRAIL_LENGTH):
+        self.points = np.zeros((length, num_vehicles, 2))
+        self.count = 0
+        self.surfaces = {}
+
+    def append(self, positions):
+        self.points[self.count % len(self.points)] = positions
+        self.count += 1
+
+    def clear(self):
+        self.count = 0
+
+    def ordered(self):
+        # oldest first
+        length = min(self.count, len(self.points))
+        start = self.count - length
+        return self.points[[(start + i) % len(self.points) for i in range(length)]]
+
+    def dot(self, color, alpha):
+        key = (color, alpha)
+        if key not in self.surfaces:
+            surface = pygame.Surface((4, 4), pygame.SRCALPHA)
+            pygame.draw.circle(surface, (*color, alpha), (2, 2), 2)
+            self.surfaces[key] = surface
+        return self.surfaces[key]
+
+
+def draw_lights(surface, font, frame, camera):
+    radius = MODELS[MODEL]["light_radius"]
+    glow = radius + 20
+    visible = camera.visible(frame["light_position"], glow)
+    screen_positions = camera.world_to_screen(frame["light_position"])
+
+    for i in np.flatnonzero(visible):
+        position = screen_positions[i]
+        color = LIGHT_COLORS[i % len(LIGHT_COLORS)]
+        alpha = int(255 * frame["light_intensity"][i])
+
+        for j in range(3):
+            glow_radius = max(1, int((radius + (j * 10)) * camera.zoom))
+            glow_alpha = max(20, alpha // (j + 2))
+            glow_surface = pygame.Surface((glow_radius * 2, glow_radius * 2), pygame.SRCALPHA)
+            pygame.draw.circle(glow_surface, (*color, glow_alpha), (glow_radius, glow_radius), glow_radius)
+            surface.blit(glow_surface, (position[0] - glow_radius, position[1] - glow_radius))
+
+        pygame.draw.circle(surface, color, position, max(1, radius * camera.zoom))
+        text = font.render(str(int(frame["visited_count"][i])), True, WHITE)
+        surface.blit(text, (position[0] - 10, position[1] - 8))
+
+
+def draw_obstacles(surface, obstacles, camera):
+    middle = (obstacles.start + obstacles.end) / 2
+    reach = np.linalg.norm(obstacles.segment, axis=-1) / 2 + obstacles.thickness
+    start = camera.world_to_screen(obstacles.start)
+    end = camera.world_to_screen(obstacles.end)
+    for i in np.flatnonzero(camera.visible(middle, reach)):
+        width = max(1, int(2 * obstacles.thickness[i] * camera.zoom))
+        if i < obstacles.num_walls:
+            pygame.draw.line(surface, GREY, start[i], end[i], width)
+        else:
+            pygame.draw.circle(surface, GREY, start[i], max(1, width / 2))
+
+
+def draw_trails(surface, trails, camera):
+    points = trails.ordered()
+    for j, layer in enumerate(points):
+        alpha = int(255 * (j / len(points)) * 0.3)
+        if alpha <= 10:
+            continue
+        dot = trails.dot(RED, alpha)
+        for pos in camera.world_to_screen(layer[camera.visible(layer)]):
+            surface.blit(dot, pos)
+
+
+def draw_debug_info(surface, font, frame, camera, draw_fps, sim_rate, drawn, level):
+    mono, friction, inhibition, cross = frame["toggles"]
+    debug_text = [
+        f"{MODEL} ({'separate process' if SEPARATE_PROCESS else 'in process'})",
+        f"Sensors: {'1' if mono else '2'}",
+        f"Friction: {'on' if friction else 'off'}",
+        f"Inhibition: {'on' if inhibition else 'off'}",
+        f"Connection: {'ipsi' if cross else 'contra'}",
+        f"Exploration: {float(frame['exploration_noise']):.1f}",
+        f"Tick: {int(frame['tick'])}",
+        f"Draw fps: {draw_fps:.0f}  Sim ticks/s: {sim_rate:.0f}",
+        f"Zoom: {camera.zoom:.2f}  Drawn: {drawn}/{len(frame['position'])} ({level})",
+    ]
+
+    y_offset = 10
+    for line in debug_text:
+        text_surface = font.render(line, True, WHITE)
+        surface.blit(text_surface, (10, y_offset))
+        y_offset += 20
+
+
+def main():
+    pygame.init()
+    screen = pygame.display.set_mode((VIEW_WIDTH, VIEW_HEIGHT))
+    pygame.display.set_caption(f"Braitenberg Vehicle - {MODEL}")
+
+    pygame.font.init()
+    font = pygame.font.SysFont("Arial", 16)
+    clock = pygame.time.Clock()
+
+    obstacles = None
+    if MAZE_SPACING:
+        width = WORLD_WIDTH or MODELS[MODEL]["width"]
+        height = WORLD_HEIGHT or MODELS[MODEL]["height"]
+        obstacles = Obstacles(maze_walls(width, height, MAZE_SPACING))
+    occlusion = Occlusion() if OCCLUSION else None
+    light_motion = LightMotion(**LIGHT_MOTION) if LIGHT_MOTION else None
+    pheromone = PheromoneField(**PHEROMONE) if PHEROMONE else None
+
+    if SEPARATE_PROCESS:
+        sim_process = SimulationProcess(
+            NUM_VEHICLES, NUM_WORLDS, MODEL, WORLD_WIDTH, WORLD_HEIGHT, heatmap_cell=HEATMAP_CELL, compact=COMPACT,
+            obstacles=obstacles, occlusion=occlusion, light_motion=light_motion, pheromone=pheromone,
+            periodic=PERIODIC,
+        )
+        sim_process.start()
+        world_width, world_height = sim_process.world_size
+        occupancy = sim_process.heatmap.array
+    else:
+        sim = Simulation(
+            NUM_VEHICLES, NUM_WORLDS, MODEL, WORLD_WIDTH, WORLD_HEIGHT, compact=COMPACT, obstacles=obstacles,
+            occlusion=occlusion, pheromone=pheromone, periodic=PERIODIC,
+        )
+        if light_motion is not None:
+            sim.add_stage(light_motion)
+        print(sim.memory_report())
+        world_width, world_height = sim.width, sim.height
+        occupancy = sim.add_stage(OccupancyGrid(sim.width, sim.height, HEATMAP_CELL)).counts
+
+    camera = Camera(VIEW_WIDTH, VIEW_HEIGHT, world_width, world_height)
+    params = MODELS[MODEL]
+    renderer = VehicleRenderer(params["radius"], params["sensor_radius"], params["sensor_spacing"])
+    heatmap = HeatmapOverlay(occupancy.shape, HEATMAP_CELL)
+    trails = Trails(NUM_VEHICLES)
+    last_tick = 0
+    last_time = pygame.time.get_ticks()
+    sim_rate = 0
+
+    running = True
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                running = False
+            if event.type == pygame.KEYDOWN and event.key in KEY_COMMANDS:
+                command = KEY_COMMANDS[event.key]
+                if SEPARATE_PROCESS:
+                    sim_process.send(command)
+                else:
+                    sim.apply_command(command)
+                if command == "reset":
+                    trails.clear()
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_l:
+                renderer.cycle_level()
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_h:
+                heatmap.toggle()
+            if event.type == pygame.KEYDOWN and event.key == pygame.K_f:
+                camera = Camera(VIEW_WIDTH, VIEW_HEIGHT, world_width, world_height)
+            if event.type == pygame.MOUSEWHEEL:
+                camera.zoom_at(ZOOM_STEP ** event.y, pygame.mouse.get_pos())
+            if event.type == pygame.MOUSEMOTION and event.buttons[0]:
+                camera.pan(-event.rel[0], -event.rel[1])
+
+        pressed = pygame.key.get_pressed()
+        for key, (dx, dy) in PAN_KEYS.items():
+            if pressed[key]:
+                camera.pan(dx * PAN_SPEED, dy * PAN_SPEED)
+
+        if SEPARATE_PROCESS:
+            frame = sim_process.read()
+        else:
+            sim.step()
+            frame = local_frame(sim)
+
+        trails.append(frame["position"])
+
+        now = pygame.time.get_ticks()
+        if now - last_time >= 1000:
+            sim_rate = (int(frame["tick"]) - last_tick) * 1000 / (now - last_time)
+            last_tick = int(frame["tick"])
+            last_time = now
+
+        screen.fill((20, 20, 40))
+        if heatmap.enabled:
+            heatmap.refresh(occupancy, now)
+            heatmap.draw(screen, camera)
+        if obstacles is not None:
+            draw_obstacles(screen, obstacles, camera)
+        draw_lights(screen, font, frame, camera)
+        visible, level = renderer.cull(frame, camera)
+        if level == "full":
+            draw_trails(screen, trails, camera)
+        renderer.draw(screen, frame, camera, visible, level, mono=bool(frame["toggles"][0]))
+        draw_debug_info(screen, font, frame, camera, clock.get_fps(), sim_rate, len(visible), level)
+
+        pygame.display.flip()
+        clock.tick(fps)
+
+    if SEPARATE_PROCESS:
+        del occupancy
+        sim_process.close()
+    pygame.quit()
+
+
+if __name__ == "__main__":
+    main()